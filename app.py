@@ -1,7 +1,60 @@
-from flask import Flask, render_template, request
+import os
+import tempfile
+from functools import wraps
+from time import perf_counter
+from flask import Flask, Response, jsonify, make_response, render_template, request, send_file
+from charts import ChartCache
+from defuzzification import DefuzzifierFactory
 from final_result import ProvideResult
+from metrics import metrics
 
 app = Flask(__name__)
+# the web app records metrics unless FUZZY_METRICS=0
+metrics.enabled = os.environ.get('FUZZY_METRICS', '1') != '0'
+# build the fuzzy system once when the app starts instead of on the first request
+provide_result = ProvideResult()
+# rendered charts are kept on disk and shared by the worker processes
+chart_cache = ChartCache(os.environ.get('FUZZY_CHART_DIR', os.path.join(tempfile.gettempdir(), 'fuzzy-charts')))
+
+
+def instrumented(route):
+    '''Record the duration, the count and the errors of the requests of a view.'''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return view(*args, **kwargs)
+            start, failed = perf_counter(), True
+            try:
+                response = make_response(view(*args, **kwargs))
+                failed = response.status_code >= 400
+                return response
+            finally:
+                metrics.observe('fuzzy_request_duration_seconds', perf_counter() - start, route=route)
+                metrics.increment('fuzzy_requests_total', route=route)
+                if failed:
+                    metrics.increment('fuzzy_request_errors_total', route=route)
+        return wrapper
+    return decorator
+
+
+def parse_request(parse):
+    '''Parse the request body with the given function and record its duration.'''
+    if not metrics.enabled:
+        return parse()
+    start = perf_counter()
+    result = parse()
+    metrics.observe_stage('parse', perf_counter() - start)
+    return result
+
+
+def get_method() -> str:
+    '''Returns the defuzzification method chosen by the method argument of the request, None for the
+    default method. raises ValueError if there is no method with this name.'''
+    method = request.values.get('method') or None
+    if method is not None and method not in DefuzzifierFactory.methods:
+        raise ValueError(f'Unknown defuzzification method {method!r}, it must be one of {", ".join(DefuzzifierFactory.methods)}')
+    return method
 
 
 @app.route('/')
@@ -10,12 +63,90 @@ def main_page():
 
 
 @app.route('/result', methods=['GET', 'POST'])
+@instrumented('/result')
 def final_result():
-    input_dict = request.form.to_dict()
-    print(input_dict)
-    provide_result = ProvideResult()
-    output = provide_result.get_final_result(input_dict=input_dict)
-    return render_template('result.html', output=output)
+    input_dict = parse_request(request.form.to_dict)
+    try:
+        output, cut_values = provide_result.get_final_result_and_cut_values(input_dict=input_dict, method=get_method())
+    except ValueError as e:
+        return render_template('result.html', error=str(e)), 400
+    return render_template('result.html', output=output, cut_values=cut_values)
+
+
+@app.route('/api/score', methods=['POST'])
+@instrumented('/api/score')
+def score_result():
+    record = parse_request(lambda: request.get_json(silent=True))
+    if not isinstance(record, dict):
+        return jsonify(error='Request body must be a JSON object'), 400
+    try:
+        output = provide_result.get_batch_results([record], get_method())[0]
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(output), 400 if 'error' in output else 200
+
+
+@app.route('/api/results', methods=['POST'])
+@instrumented('/api/results')
+def batch_results():
+    records = parse_request(lambda: request.get_json(silent=True))
+    if not isinstance(records, list):
+        return jsonify(error='Request body must be a JSON array of records'), 400
+    try:
+        return jsonify(provide_result.get_batch_results(records, get_method()))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+
+@app.route('/api/explain', methods=['POST'])
+@instrumented('/api/explain')
+def explain_result():
+    input_dict = parse_request(lambda: request.get_json(silent=True))
+    if not isinstance(input_dict, dict):
+        return jsonify(error='Request body must be a JSON object'), 400
+    try:
+        return jsonify(provide_result.get_trace(input_dict, get_method()))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+
+@app.route('/api/sweep', methods=['POST'])
+@instrumented('/api/sweep')
+def sweep_results():
+    body = parse_request(lambda: request.get_json(silent=True))
+    if not isinstance(body, dict) or not isinstance(body.get('input', {}), dict):
+        return jsonify(error='Request body must be a JSON object with input and sweep objects'), 400
+    try:
+        return jsonify(provide_result.get_sweep(body.get('input', {}), body.get('sweep'), get_method()))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+
+@app.route('/charts/<name>.png')
+@instrumented('/charts')
+def chart(name):
+    param = provide_result.get_parameter(name)
+    if param is None:
+        return jsonify(error=f'Parameter {name} not found'), 404
+    # query arguments are the cut values of the fuzzysets, e.g. /charts/health.png?sick_1=0.4
+    cut_values = dict()
+    for set_name, value in request.args.items():
+        try:
+            cut_values[set_name] = float(value)
+        except ValueError:
+            return jsonify(error=f'Cut value of {set_name} is not a number: {value!r}'), 400
+        if set_name not in param.sets or not 0 <= cut_values[set_name] <= 1:
+            return jsonify(error=f'Cut value of {set_name} must be a fuzzyset of {name} between 0 and 1'), 400
+    key, path = chart_cache.get_chart(param, cut_values)
+    # the hash of the definition and the cut values is the ETag, a changed chart gets a new one
+    response = send_file(path, mimetype='image/png', etag=key, max_age=3600, conditional=True)
+    response.cache_control.public = True
+    return response
+
+
+@app.route('/metrics')
+def metrics_page():
+    return Response(metrics.export(), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+'''An ASGI entry point which scores concurrent requests in micro batches.
+
+the JSON scoring routes /api/score and /api/results of app.py are served here with the default
+defuzzification method. records of concurrent /api/score requests are queued and scored together
+with one batch evaluation, an /api/results array is already a batch so it skips the queue. while
+the queue is full, /api/score answers 503. run it with any ASGI server, e.g.
+
+    uvicorn asgi_app:app --port 8449
+
+the batching is configured with FUZZY_BATCH_SIZE (default 64), FUZZY_BATCH_WAIT_MS (default 2)
+and FUZZY_QUEUE_SIZE (default 4096).
+'''
+import asyncio
+import json
+import os
+from final_result import ProvideResult
+from micro_batching import MicroBatcher, QueueFullError
+
+provide_result = ProvideResult()
+batcher = MicroBatcher(provide_result.get_batch_results,
+                       max_batch_size=int(os.environ.get('FUZZY_BATCH_SIZE', 64)),
+                       max_wait=float(os.environ.get('FUZZY_BATCH_WAIT_MS', 2)) / 1000,
+                       max_queue_size=int(os.environ.get('FUZZY_QUEUE_SIZE', 4096)))
+
+
+async def read_body(receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+async def send_json(send, status: int, data) -> None:
+    body = json.dumps(data).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await batcher.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await batcher.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def score(body: bytes):
+    '''Score one JSON record in the next micro batch.'''
+    try:
+        record = json.loads(body)
+    except ValueError:
+        record = None
+    if not isinstance(record, dict):
+        return 400, {'error': 'Request body must be a JSON object'}
+    try:
+        output = await batcher.score(record)
+    except QueueFullError:
+        return 503, {'error': 'Server is busy, try again later'}
+    return (400 if 'error' in output else 200), output
+
+
+async def batch_results(body: bytes):
+    '''Score a JSON array of records, it is already a batch so it skips the queue.'''
+    try:
+        records = json.loads(body)
+    except ValueError:
+        records = None
+    if not isinstance(records, list):
+        return 400, {'error': 'Request body must be a JSON array of records'}
+    loop = asyncio.get_running_loop()
+    return 200, await loop.run_in_executor(batcher.executor, provide_result.get_batch_results, records)
+
+
+routes = {'/api/score': score, '/api/results': batch_results}
+
+
+async def app(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    handler = routes.get(scope['path'])
+    if handler is None:
+        await send_json(send, 404, {'error': 'Not found'})
+        return
+    if scope['method'] != 'POST':
+        await send_json(send, 405, {'error': 'Method not allowed'})
+        return
+    status, data = await handler(await read_body(receive))
+    await send_json(send, status, data)
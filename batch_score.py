@@ -0,0 +1,159 @@
+'''Score JSONL or CSV files of patients from the command line.
+
+every record uses the same field names as the form in templates/index.html. the input is read
+as a stream and scored in chunks by a pool of processes, and the results are written in input order:
+
+    python3 batch_score.py patients.jsonl scores.jsonl --workers 8 --error-column
+'''
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterator, List, Tuple
+from defuzzification import DefuzzifierFactory
+from inference import FuzzyIntelligentSystem
+
+FORMATS = {'.jsonl': 'jsonl', '.json': 'jsonl', '.csv': 'csv'}
+
+fuzzy_system = None # the fuzzy system of the current process, built once by init_worker
+
+def init_worker(rules_file: str, method: str = 'centroid') -> None:
+    '''Build the fuzzy system of a worker process with the defuzzification method of the given name.'''
+    global fuzzy_system
+    fuzzy_system = FuzzyIntelligentSystem(rules_file, defuzzifier=method)
+
+def score_chunk(records: List[Tuple[dict, str]]) -> List[Tuple[float, str, str]]:
+    '''Score a chunk of (record, error) pairs with the fuzzy system of the current process,
+    the records which could not be read keep their error.'''
+    outputs = iter(fuzzy_system.calculate_records([record for record, error in records if error is None]))
+    return [next(outputs) if error is None else (None, None, error) for record, error in records]
+
+def read_records(file, file_format: str) -> Iterator[Tuple[dict, str]]:
+    '''Read the records of a file one by one. yields (record, error) pairs, error is None for the
+    records which were read and the record is empty for the lines which are not JSON objects.'''
+    if file_format == 'csv':
+        for record in csv.DictReader(file):
+            yield record, None
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {}, f'Line {line_number} is not valid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield {}, f'Line {line_number} is not a JSON object'
+            continue
+        yield record, None
+
+def iter_chunks(records: Iterator[Tuple[dict, str]], chunk_size: int) -> Iterator[List[Tuple[dict, str]]]:
+    '''Group the records in lists of chunk_size records.'''
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+class RecordWriter:
+    '''A class to write scored records to a JSONL or CSV file.'''
+
+    def __init__(self, file, file_format: str, error_column: bool) -> None:
+        self.file = file
+        self.file_format = file_format
+        self.output_fields = ['result', 'status'] + (['error'] if error_column else [])
+        self.csv_writer = None
+
+    def write(self, record: dict, result: float, status: str, error: str) -> None:
+        output = dict(record)
+        output.update(zip(self.output_fields, (result, status, error)))
+        if self.file_format == 'jsonl':
+            self.file.write(json.dumps(output) + '\n')
+            return
+        if self.csv_writer is None:
+            # take the columns from the first record, like csv.DictReader does for the input
+            fields = [field for field in record if field not in self.output_fields] + self.output_fields
+            self.csv_writer = csv.DictWriter(self.file, fields, restval='', extrasaction='ignore')
+            self.csv_writer.writeheader()
+        self.csv_writer.writerow({key: '' if value is None else value for key, value in output.items()})
+
+def submit_in_order(executor: ProcessPoolExecutor, chunks: Iterator[List[Tuple[dict, str]]],
+                    window: int) -> Iterator[Tuple[List[Tuple[dict, str]], list]]:
+    '''Score the chunks in the executor and yield them in input order. at most window chunks are
+    in flight, so only a bounded part of the input is kept in memory.'''
+    pending = deque()
+    for chunk in chunks:
+        pending.append((chunk, executor.submit(score_chunk, chunk)))
+        if len(pending) >= window:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+    while pending:
+        chunk, future = pending.popleft()
+        yield chunk, future.result()
+
+def get_format(path: str, file_format: str, default: str) -> str:
+    '''Find the format of a file from the given format or the file extension.'''
+    if file_format:
+        return file_format
+    return FORMATS.get(os.path.splitext(path)[1].lower(), default)
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Score a JSONL or CSV file of patients with the fuzzy system.')
+    parser.add_argument('input', help='input file, - for stdin')
+    parser.add_argument('output', nargs='?', default='-', help='output file, - for stdout (default)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='input format, found from the extension by default')
+    parser.add_argument('--output-format', choices=['jsonl', 'csv'], help='output format, same as the input by default')
+    parser.add_argument('--rules', default='rules.fcl', help='rules file (default: rules.fcl)')
+    parser.add_argument('--method', choices=list(DefuzzifierFactory.methods), default='centroid',
+                        help='defuzzification method, the others approximate the centroid faster (default: centroid)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: cpu count)')
+    parser.add_argument('--chunk-size', type=int, default=2048, help='records scored together by a worker (default: 2048)')
+    parser.add_argument('--error-column', action='store_true',
+                        help='write an error column for invalid records instead of stopping at the first one')
+    return parser.parse_args(argv)
+
+def main(argv: List[str] = None) -> None:
+    args = parse_args(argv)
+    input_format = get_format(args.input, args.format, 'jsonl')
+    output_format = get_format(args.output, args.output_format, input_format)
+    input_file = sys.stdin if args.input == '-' else open(args.input, 'r', newline='')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    writer = RecordWriter(output_file, output_format, args.error_column)
+    chunks = iter_chunks(read_records(input_file, input_format), args.chunk_size)
+    rows, errors = 0, 0
+    start = time.perf_counter()
+    try:
+        if args.workers <= 1:
+            init_worker(args.rules, args.method)
+            scored_chunks = ((chunk, score_chunk(chunk)) for chunk in chunks)
+        else:
+            executor = ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(args.rules, args.method))
+            scored_chunks = submit_in_order(executor, chunks, 2 * args.workers)
+        for chunk, outputs in scored_chunks:
+            for (record, _), (result, status, error) in zip(chunk, outputs):
+                rows += 1
+                if error is not None:
+                    errors += 1
+                    if not args.error_column:
+                        raise SystemExit(f'Record {rows} is invalid: {error}')
+                writer.write(record, result, status, error)
+            output_file.flush()
+    finally:
+        if args.workers > 1:
+            executor.shutdown(cancel_futures=True)
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    elapsed = time.perf_counter() - start
+    print(f'Scored {rows} records ({errors} invalid) in {elapsed:.2f} s: {rows / elapsed if elapsed else 0:.0f} records/sec',
+          file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+'''Benchmarks of every stage of the fuzzy system and of end to end scoring.
+
+the synthetic patients come from a fixed seed, so two runs measure the same work. results are
+saved as JSON and can be compared with an earlier run to catch slow downs:
+
+    python3 benchmark.py --output before.json
+    python3 benchmark.py --output after.json --compare before.json --threshold 0.25
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+import numpy as np
+from defuzzification import CenterOfMassDefuz, CentroidDefuz, FuzzySetDefuzData, HeightDefuz, MeanOfMaximumDefuz, WeightedAverageDefuz
+from fuzzification import init_fuzzy_parameters, init_output_fuzzy_sets
+from inference import FuzzyIntelligentSystem
+from metrics import metrics
+from rule_parser import RuleParser
+
+DEFUZZIFICATION_STRIDES = (0.01, 0.005, 0.001)
+# methods which approximate the centroid from the moments of the output fuzzysets
+APPROXIMATE_DEFUZZIFIERS = {'weighted_average': WeightedAverageDefuz, 'mean_of_maximum': MeanOfMaximumDefuz, 'height': HeightDefuz}
+
+def generate_patients(count: int, seed: int = 0) -> List[dict]:
+    '''Generate input dictionaries which span the range of every fuzzy parameter. parameters whose
+    fuzzysets are single points only take the values of those points, like the form sliders.'''
+    rng = random.Random(seed)
+    params = init_fuzzy_parameters()
+    crisp_values = dict()
+    for param in params:
+        points = [fuzzy_set.membership.x for fuzzy_set in param.sets.values()]
+        if all(len(x) == 1 for x in points):
+            crisp_values[param.name_in_rules] = sorted(x[0] for x in points)
+    patients = []
+    for _ in range(count):
+        patient = dict()
+        for param in params:
+            if param.name_in_rules in crisp_values:
+                patient[param.name_in_rules] = rng.choice(crisp_values[param.name_in_rules])
+            else:
+                patient[param.name_in_rules] = round(rng.uniform(*param.range), 1)
+        patients.append(patient)
+    return patients
+
+def measure(func: Callable[[], object], number: int, repeat: int, items: int = 1) -> Dict[str, float]:
+    '''Run func number times in each of repeat samples and return latency percentiles of one call
+    and the throughput in items per second, where one call handles items items.'''
+    func()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        latencies.append((time.perf_counter() - start) / number)
+    latencies = np.array(latencies)
+    return {
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'mean_ms': float(latencies.mean() * 1000),
+        'throughput_per_sec': float(items / latencies.mean()),
+        'samples': repeat,
+    }
+
+def cycle(values: list) -> Callable[[], object]:
+    '''Returns a function which returns the next value of values on every call.'''
+    state = {'i': -1}
+    def next_value():
+        state['i'] = (state['i'] + 1) % len(values)
+        return values[state['i']]
+    return next_value
+
+def benchmark_membership(patients: List[dict], repeat: int) -> Dict[str, dict]:
+    results = dict()
+    for param in init_fuzzy_parameters():
+        xs = [float(patient[param.name_in_rules]) for patient in patients]
+        fuzzy_sets = list(param.sets.values())
+        next_x = cycle(xs)
+        results[f'membership/{param.name_in_rules}'] = measure(
+            lambda: [fuzzy_set.get_value(next_x()) for fuzzy_set in fuzzy_sets], 200, repeat, len(fuzzy_sets))
+        array = np.array(xs)
+        results[f'membership_batch/{param.name_in_rules}'] = measure(
+            lambda: [fuzzy_set.get_values(array) for fuzzy_set in fuzzy_sets], 5, repeat, len(fuzzy_sets) * len(xs))
+    return results
+
+def benchmark_construction(rules_file: str, repeat: int) -> Dict[str, dict]:
+    with open(rules_file) as f:
+        lines = [line[:-1] for line in f]
+    return {
+        'construction/parse_rules': measure(lambda: [RuleParser.parse_rule(line) for line in lines], 5, repeat, len(lines)),
+        'construction/engine': measure(lambda: FuzzyIntelligentSystem(rules_file, use_model_cache=True), 2, repeat),
+        'construction/engine_uncached': measure(lambda: FuzzyIntelligentSystem(rules_file), 2, repeat),
+    }
+
+def benchmark_rules(fuzzy_system: FuzzyIntelligentSystem, patients: List[dict], repeat: int) -> Dict[str, dict]:
+    next_patient = cycle(patients)
+    columns = {name: np.array([float(patient[name]) for patient in patients]) for name in patients[0]}
+    return {
+        'rules/evaluate': measure(lambda: fuzzy_system.compiled_rules.evaluate(next_patient()), 50, repeat),
+        'rules/evaluate_batch': measure(lambda: fuzzy_system.compiled_rules.evaluate_batch(columns), 3, repeat, len(patients)),
+    }
+
+def benchmark_sweep(fuzzy_system: FuzzyIntelligentSystem, patients: List[dict], repeat: int) -> Dict[str, dict]:
+    results = dict()
+    next_patient = cycle(patients)
+    for name in fuzzy_system.compiled_rules.parameter_names:
+        low, high = fuzzy_system.fuzzy_parameters[name].range
+        values = np.linspace(low, high, 101)
+        results[f'sweep/{name}'] = measure(lambda: fuzzy_system.sweep(next_patient(), {name: values}), 5, repeat, len(values))
+    return results
+
+def benchmark_defuzzification(fuzzy_system: FuzzyIntelligentSystem, patients: List[dict], repeat: int) -> Dict[str, dict]:
+    output_param = init_output_fuzzy_sets()
+    fuzzy_sets = list(output_param.sets.values())
+    cut_values = [fuzzy_system.compiled_rules.evaluate(patient) for patient in patients]
+    data = [[FuzzySetDefuzData(fuzzy_set, cut) for fuzzy_set, cut in zip(fuzzy_sets, cuts)] for cuts in cut_values]
+    cut_array = np.array(cut_values)
+    methods = {f'center_of_mass_{stride}': CenterOfMassDefuz(stride=stride, range=output_param.range) for stride in DEFUZZIFICATION_STRIDES}
+    methods['centroid'] = CentroidDefuz(range=output_param.range)
+    methods.update((name, method()) for name, method in APPROXIMATE_DEFUZZIFIERS.items())
+    results = dict()
+    for name, method in methods.items():
+        next_data = cycle(data)
+        results[f'defuzzification/{name}'] = measure(lambda: method.defuzzify(next_data()), 3, repeat)
+        results[f'defuzzification_batch/{name}'] = measure(lambda: method.defuzzify_batch(fuzzy_sets, cut_array), 1, repeat, len(cut_array))
+    return results
+
+def get_defuzzification_accuracy(fuzzy_system: FuzzyIntelligentSystem, patients: List[dict], results: Dict[str, dict]) -> Dict[str, dict]:
+    '''Returns the speedup of every defuzzification method over the exact centroid, from the p50 latencies of
+    benchmark_defuzzification, and its largest and mean deviation from the centroid on the patients.'''
+    output_param = init_output_fuzzy_sets()
+    fuzzy_sets = list(output_param.sets.values())
+    cut_array = np.array([fuzzy_system.compiled_rules.evaluate(patient) for patient in patients])
+    exact = CentroidDefuz(range=output_param.range).defuzzify_batch(fuzzy_sets, cut_array)
+    methods = {f'center_of_mass_{stride}': CenterOfMassDefuz(stride=stride, range=output_param.range) for stride in DEFUZZIFICATION_STRIDES}
+    methods.update((name, method()) for name, method in APPROXIMATE_DEFUZZIFIERS.items())
+    accuracy = dict()
+    for name, method in methods.items():
+        # patients which fire no rule have no result with any method
+        deviations = np.abs(method.defuzzify_batch(fuzzy_sets, cut_array) - exact)
+        accuracy[name] = {
+            'speedup': results['defuzzification/centroid']['p50_ms'] / results[f'defuzzification/{name}']['p50_ms'],
+            'speedup_batch': results['defuzzification_batch/centroid']['p50_ms'] / results[f'defuzzification_batch/{name}']['p50_ms'],
+            'max_deviation': float(np.nanmax(deviations)),
+            'mean_deviation': float(np.nanmean(deviations)),
+        }
+    return accuracy
+
+def benchmark_end_to_end(patients: List[dict], repeat: int) -> Dict[str, dict]:
+    # every repeat sends the same patients, with the result cache or the centroid memo all but the
+    # first repeat would only time lookups instead of scoring
+    os.environ['FUZZY_CACHE_SIZE'] = '0'
+    os.environ['FUZZY_DEFUZZ_MEMO_SIZE'] = '0'
+    os.environ['FUZZY_METRICS'] = '0'
+    import app
+    client = app.app.test_client()
+    forms = [{name: str(value) for name, value in patient.items()} for patient in patients]
+    next_form = cycle(forms)
+    return {
+        'end_to_end/result_form': measure(lambda: client.post('/result', data=next_form()), 10, repeat),
+        'end_to_end/api_results': measure(lambda: client.post('/api/results', json=patients), 1, repeat, len(patients)),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(patients_count: int, seed: int, repeat: int, rules_file: str) -> dict:
+    patients = generate_patients(patients_count, seed)
+    # nothing is measured with metrics, recording them would add to every stage
+    metrics_enabled = metrics.enabled
+    metrics.enabled = False
+    fuzzy_system = FuzzyIntelligentSystem(rules_file)
+    results = dict()
+    results.update(benchmark_membership(patients, repeat))
+    results.update(benchmark_construction(rules_file, repeat))
+    results.update(benchmark_rules(fuzzy_system, patients, repeat))
+    results.update(benchmark_sweep(fuzzy_system, patients, repeat))
+    results.update(benchmark_defuzzification(fuzzy_system, patients, repeat))
+    results.update(benchmark_end_to_end(patients, repeat))
+    accuracy = get_defuzzification_accuracy(fuzzy_system, patients, results)
+    metrics.enabled = metrics_enabled
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'config': {'patients': patients_count, 'seed': seed, 'repeat': repeat, 'rules_file': rules_file},
+        'results': results,
+        'defuzzification_accuracy': accuracy,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float, metric: str = 'p50_ms') -> List[str]:
+    '''Returns a message for every benchmark which is more than threshold (a fraction) slower than the baseline.'''
+    regressions = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before, after = baseline['results'][name][metric], result[metric]
+        if before > 0 and after > before * (1 + threshold):
+            regressions.append(f'{name}: {metric} {before:.4f} -> {after:.4f} ({(after / before - 1) * 100:+.0f}%)')
+    return regressions
+
+def print_results(report: dict) -> None:
+    print(f'{"benchmark":<48}{"p50 ms":>12}{"p95 ms":>12}{"p99 ms":>12}{"items/s":>14}')
+    for name, result in report['results'].items():
+        print(f'{name:<48}{result["p50_ms"]:>12.4f}{result["p95_ms"]:>12.4f}{result["p99_ms"]:>12.4f}{result["throughput_per_sec"]:>14.0f}')
+    print(f'\n{"defuzzification vs centroid":<48}{"speedup":>12}{"batch":>12}{"max dev":>12}{"mean dev":>14}')
+    for name, result in report.get('defuzzification_accuracy', dict()).items():
+        print(f'{name:<48}{result["speedup"]:>11.1f}x{result["speedup_batch"]:>11.1f}x'
+              f'{result["max_deviation"]:>12.4f}{result["mean_deviation"]:>14.4f}')
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the fuzzy system.')
+    parser.add_argument('--patients', type=int, default=1000, help='number of synthetic patients (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic patients (default: 0)')
+    parser.add_argument('--repeat', type=int, default=20, help='latency samples per benchmark (default: 20)')
+    parser.add_argument('--rules', help='rules file (default: rules.fcl of the repository)')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slow down against --compare as a fraction of the p50 latency (default: 0.2)')
+    args = parser.parse_args(argv)
+    output, baseline = [os.path.abspath(path) if path else None for path in (args.output, args.compare)]
+    rules_file = os.path.abspath(args.rules) if args.rules else 'rules.fcl'
+    # the default rules file and the app's templates are found relative to the repository
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    report = run(args.patients, args.seed, args.repeat, rules_file)
+    print_results(report)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print('Regressions:\n' + '\n'.join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print(f'No benchmark is more than {args.threshold * 100:.0f}% slower than {args.compare}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''Charts of the fuzzysets of the parameters, rendered without a display and cached on disk.
+
+render the chart of every parameter and of the output to a directory, e.g. to update fuzzysets/:
+
+    python3 charts.py --output fuzzysets
+    python3 charts.py --output charts --cut sick_1=0.4 --cut sick_2=0.7
+'''
+import argparse
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+from files import atomic_write
+from fuzzification import FuzzyParameter, init_fuzzy_parameters, init_output_fuzzy_sets
+
+# change it when the look of the charts changes, so cached charts are rendered again
+CHART_VERSION = 1
+
+class ChartCache:
+    '''A class to keep rendered charts in a directory. a chart is stored under a hash of the
+    definition of its parameter and its cut values, so a changed fuzzyset gets a new file.
+    the least recently used charts are deleted when there are more than max_files.'''
+
+    def __init__(self, directory: str, max_files: int = 1000, decimals: int = 3) -> None:
+        self.directory = directory
+        self.max_files = max_files
+        self.decimals = decimals
+        # matplotlib is not thread safe, charts are rendered one at a time
+        self.lock = threading.Lock()
+
+    def get_key(self, param: FuzzyParameter, cut_values: Dict[str, float] = None) -> str:
+        '''Returns the hash of a chart, cut values are rounded to decimals digits.'''
+        cut_values = {name: round(float(value), self.decimals) for name, value in (cut_values or dict()).items()}
+        data = {'version': CHART_VERSION, 'definition': param.get_definition(), 'cut_values': cut_values}
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def get_chart(self, param: FuzzyParameter, cut_values: Dict[str, float] = None) -> Tuple[str, str]:
+        '''Returns the hash and the path of the PNG chart of a parameter, it is rendered if it is not cached.'''
+        key = self.get_key(param, cut_values)
+        path = os.path.join(self.directory, f'{key}.png')
+        try:
+            # the modification time orders the charts for eviction
+            os.utime(path)
+            return key, path
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.directory, exist_ok=True)
+        cut_values = {name: round(float(value), self.decimals) for name, value in cut_values.items()} if cut_values else None
+        with self.lock:
+            with atomic_write(path, 'wb') as f:
+                param.render(f, cut_values)
+            self.__evict()
+        return key, path
+
+    def __evict(self) -> None:
+        charts = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.png') and not entry.name.startswith('.')]
+        if len(charts) <= self.max_files:
+            return
+        charts.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in charts[:len(charts) - self.max_files]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+def render_all(directory: str, cut_values: Dict[str, float] = None) -> List[str]:
+    '''Render the chart of every fuzzy parameter and of the output, with the cut values of the
+    output fuzzysets, to <name>.png files in a directory. returns the paths of the files.'''
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for param in init_fuzzy_parameters():
+        paths.append(os.path.join(directory, f'{param.name}.png'))
+        param.render(paths[-1])
+    output_param = init_output_fuzzy_sets()
+    paths.append(os.path.join(directory, f'{output_param.name}.png'))
+    output_param.render(paths[-1], cut_values)
+    return paths
+
+def parse_cut_values(items: List[str]) -> Dict[str, float]:
+    '''Parse cut values written like "sick_1=0.4".'''
+    cut_values = dict()
+    for item in items:
+        name, value = item.split('=')
+        cut_values[name.strip()] = float(value)
+    return cut_values
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description='Render the charts of the fuzzysets to PNG files.')
+    parser.add_argument('--output', default='fuzzysets', help='directory of the charts (default: fuzzysets)')
+    parser.add_argument('--cut', action='append', default=[], metavar='SET=VALUE',
+                        help='cut value of an output fuzzyset, can be given more than once')
+    args = parser.parse_args(argv)
+    for path in render_all(args.output, parse_cut_values(args.cut) or None):
+        print(path)
+
+if __name__ == '__main__':
+    main()
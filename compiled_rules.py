@@ -0,0 +1,193 @@
+from functools import reduce
+from typing import Dict, List, Tuple, TYPE_CHECKING
+import numpy as np
+from fuzzification import FuzzyParameter
+from rule_parser import Expression, TermExpression
+
+if TYPE_CHECKING:
+    from inference import FuzzyOperator, Rule
+
+class CompiledRulebase:
+    '''A flat, index based form of a list of rules. every distinct (parameter, fuzzyset) term
+    is stored once in a table and the conditions of the rules are stored as a table of nodes,
+    where equal subexpressions of any rules are one node. a node is either a term or an operator
+    applied to other nodes, and nodes come after their operands. so every membership and every
+    subexpression is calculated once per evaluation no matter how many rules use it.'''
+
+    def __init__(self, rules: List['Rule'], fuzzy_parameters: Dict[str, FuzzyParameter], output_param: FuzzyParameter,
+                 operators: Dict[str, 'FuzzyOperator']) -> None:
+        self.terms = [] # the distinct RuleTerms of the rules, in order of first use
+        self.term_sets = [] # fuzzyset of each term, None if its parameter or fuzzyset is not defined
+        self.consequents = list(output_param.sets.keys())
+        self.nodes = [] # type: List[Tuple[FuzzyOperator, Tuple[int, ...]]] operator None is the term operands[0]
+        self.rule_nodes = [] # type: List[int]
+        self.rule_terms = [] # type: List[Tuple[int, ...]]
+        self.rule_consequents = [] # type: List[int]
+        self.operators = operators
+        term_indices = dict()
+        node_indices = dict()
+        for rule in rules:
+            if rule.then_clause_item.fuzzyset_name not in output_param.sets:
+                location = f'line {rule.line_number}: ' if rule.line_number is not None else ''
+                raise ValueError(f'{location}Fuzzyset {rule.then_clause_item.fuzzyset_name} is not in output parameter')
+            for term in rule.if_clause_items:
+                key = (term.parameter_name, term.fuzzyset_name)
+                if key not in term_indices:
+                    term_indices[key] = len(self.terms)
+                    self.terms.append(term)
+                    param = fuzzy_parameters.get(term.parameter_name)
+                    self.term_sets.append(param.sets.get(term.fuzzyset_name) if param else None)
+            self.rule_nodes.append(self.__compile(rule.condition, term_indices, node_indices))
+            self.rule_terms.append(tuple(term_indices[(term.parameter_name, term.fuzzyset_name)] for term in rule.if_clause_items))
+            self.rule_consequents.append(self.consequents.index(rule.then_clause_item.fuzzyset_name))
+        # indices of the rules that conclude each consequent, used to aggregate a batch
+        self.consequent_rules = [np.array([r for r, c in enumerate(self.rule_consequents) if c == i], dtype=int)
+                                 for i in range(len(self.consequents))]
+        self.parameter_names = list(dict.fromkeys(term.parameter_name for term in self.terms))
+
+    def __compile(self, expression: Expression, term_indices: Dict[Tuple[str, str], int],
+                  node_indices: Dict[Expression, int]) -> int:
+        '''Returns the node index of an expression, adding the nodes of it and its operands if they are new.'''
+        if expression in node_indices:
+            return node_indices[expression]
+        if isinstance(expression, TermExpression):
+            node = (None, (term_indices[(expression.parameter_name, expression.fuzzyset_name)],))
+        else:
+            node = (self.operators[expression.operator],
+                    tuple(self.__compile(operand, term_indices, node_indices) for operand in expression.operands))
+        node_indices[expression] = len(self.nodes)
+        self.nodes.append(node)
+        return node_indices[expression]
+
+    def __check_term(self, index: int, input_names) -> None:
+        '''Raise the same errors as the rule by rule evaluation for a term that can not be calculated.'''
+        term = self.terms[index]
+        if term.parameter_name not in input_names:
+            raise ValueError(f'Parameter {term.parameter_name} is not in input dict')
+        if self.term_sets[index] is None:
+            raise ValueError(f'Parameter {term.parameter_name} is not in fuzzy parameters')
+
+    def get_memberships(self, input_dict: dict) -> List[float]:
+        '''Calculate the membership value of every term for an input dictionary.'''
+        memberships = []
+        for i, term in enumerate(self.terms):
+            self.__check_term(i, input_dict)
+            memberships.append(self.term_sets[i].get_value(float(input_dict[term.parameter_name])))
+        return memberships
+
+    def get_rule_strengths(self, memberships: List[float], input_dict: dict = None) -> List[float]:
+        '''Calculate the firing strength of every rule from the term memberships. with an input
+        dictionary, memberships which are None are calculated when a rule needs them.'''
+        values = [None] * len(self.nodes)
+        return [self.__get_value(node, memberships, values, input_dict) for node in self.rule_nodes]
+
+    def __get_value(self, node: int, memberships: List[float], values: List[float], input_dict: dict) -> float:
+        '''Returns the value of a node, AND stops at the first operand which is 0 and OR at the first one which is 1.'''
+        value = values[node]
+        if value is not None:
+            return value
+        operator, operands = self.nodes[node]
+        if operator is None:
+            term = operands[0]
+            value = memberships[term]
+            if value is None:
+                value = memberships[term] = self.term_sets[term].get_value(float(input_dict[self.terms[term].parameter_name]))
+        elif len(operands) == 1:
+            value = operator.get_fuzzy_value(self.__get_value(operands[0], memberships, values, input_dict))
+        else:
+            for operand in operands:
+                operand_value = self.__get_value(operand, memberships, values, input_dict)
+                value = operand_value if value is None else operator.get_fuzzy_value(value, operand_value)
+                if value == operator.absorbing_value:
+                    break
+        values[node] = value
+        return value
+
+    def get_cut_values(self, strengths: List[float]) -> List[float]:
+        '''Aggregate the rule strengths to the cut value of every consequent with max.'''
+        cut_values = [0] * len(self.consequents)
+        for consequent, strength in zip(self.rule_consequents, strengths):
+            if strength > cut_values[consequent]:
+                cut_values[consequent] = strength
+        return cut_values
+
+    def evaluate(self, input_dict: dict) -> List[float]:
+        '''Calculate the cut value of every consequent for an input dictionary. memberships are
+        only calculated for the terms a rule reaches, but every term is checked first so a
+        missing input is an error even if the rules which use it are cut short.'''
+        for i in range(len(self.terms)):
+            self.__check_term(i, input_dict)
+        return self.get_cut_values(self.get_rule_strengths([None] * len(self.terms), input_dict))
+
+    def get_memberships_batch(self, input_arrays: Dict[str, np.ndarray]) -> np.ndarray:
+        '''Calculate the membership values of every term for a batch, shape (terms, samples).'''
+        size = len(next(iter(input_arrays.values()))) if input_arrays else 0
+        memberships = np.empty((len(self.terms), size))
+        for i, term in enumerate(self.terms):
+            self.__check_term(i, input_arrays)
+            memberships[i] = self.term_sets[i].get_values(input_arrays[term.parameter_name])
+        return memberships
+
+    def __get_node_values(self, memberships: list) -> list:
+        '''Calculate the value of every node in order. memberships are floats or arrays, and the
+        value of a node is a float unless one of its operands is an array.'''
+        values = []
+        for operator, operands in self.nodes:
+            if operator is None:
+                values.append(memberships[operands[0]])
+                continue
+            operand_values = [values[operand] for operand in operands]
+            if any(isinstance(value, np.ndarray) for value in operand_values):
+                function = operator.get_fuzzy_values
+            else:
+                function = operator.get_fuzzy_value
+            values.append(function(operand_values[0]) if len(operands) == 1 else reduce(function, operand_values))
+        return values
+
+    def get_rule_strengths_batch(self, memberships: np.ndarray) -> np.ndarray:
+        '''Calculate the firing strengths of every rule for a batch, shape (rules, samples).'''
+        values = self.__get_node_values(list(memberships))
+        strengths = np.empty((len(self.rule_nodes), memberships.shape[1]))
+        for r, node in enumerate(self.rule_nodes):
+            strengths[r] = values[node]
+        return strengths
+
+    def get_cut_values_batch(self, strengths: np.ndarray) -> np.ndarray:
+        '''Aggregate the rule strengths of a batch, shape (samples, consequents).'''
+        cut_values = np.zeros((strengths.shape[1], len(self.consequents)))
+        for i, rules in enumerate(self.consequent_rules):
+            if len(rules):
+                np.maximum(cut_values[:, i], strengths[rules].max(axis=0), out=cut_values[:, i])
+        return cut_values
+
+    def evaluate_batch(self, input_arrays: Dict[str, np.ndarray]) -> np.ndarray:
+        '''Calculate the cut values of every consequent for a batch, shape (samples, consequents).'''
+        return self.get_cut_values_batch(self.get_rule_strengths_batch(self.get_memberships_batch(input_arrays)))
+
+    def evaluate_sweep(self, input_dict: dict, sweep_arrays: Dict[str, np.ndarray]) -> np.ndarray:
+        '''Calculate the cut values of every consequent for an input dictionary whose swept parameters
+        take the values of the given 1-D arrays of equal length, shape (points, consequents).
+        terms and rules which do not use a swept parameter are calculated once for all the points.'''
+        size = len(next(iter(sweep_arrays.values()))) if sweep_arrays else 0
+        memberships = []
+        for i, term in enumerate(self.terms):
+            if term.parameter_name in sweep_arrays:
+                if self.term_sets[i] is None:
+                    raise ValueError(f'Parameter {term.parameter_name} is not in fuzzy parameters')
+                memberships.append(self.term_sets[i].get_values(sweep_arrays[term.parameter_name]))
+            else:
+                self.__check_term(i, input_dict)
+                memberships.append(self.term_sets[i].get_value(float(input_dict[term.parameter_name])))
+        values = self.__get_node_values(memberships)
+        # rules without a swept term have float strengths, they set the base cut values of every point
+        base_cut_values = [0] * len(self.consequents)
+        swept_strengths = []
+        for node, consequent in zip(self.rule_nodes, self.rule_consequents):
+            if isinstance(values[node], np.ndarray):
+                swept_strengths.append((consequent, values[node]))
+            else:
+                base_cut_values[consequent] = max(base_cut_values[consequent], values[node])
+        cut_values = np.tile(np.array(base_cut_values, dtype=float), (size, 1))
+        for consequent, strength in swept_strengths:
+            np.maximum(cut_values[:, consequent], strength, out=cut_values[:, consequent])
+        return cut_values
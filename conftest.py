@@ -0,0 +1 @@
+# the modules of the app are at the root of the repository, pytest puts this directory on the path for the tests
@@ -1,6 +1,11 @@
 from dataclasses import dataclass
 from abc import abstractmethod, ABC
-from typing import List
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import combinations
+import threading
+from typing import List, Tuple
+import numpy as np
 from fuzzification import FuzzySet
 
 @dataclass
@@ -15,14 +20,20 @@ class DefuzzificationMethod(ABC):
     def defuzzify(self, data: List[FuzzySetDefuzData]) -> float:
         '''Defuzzify the data.'''
         pass
+
+    def defuzzify_batch(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        '''Defuzzify a batch of cut values. cut_values has one row per sample and one column per fuzzyset.'''
+        return np.array([self.defuzzify([FuzzySetDefuzData(fuzzy_set, cut) for fuzzy_set, cut in zip(fuzzy_sets, row)])
+                         for row in cut_values], dtype=float)
     
 class CenterOfMassDefuz(DefuzzificationMethod): 
     '''A class to calculate the center of mass of the output fuzzysets.'''
 
-    def __init__(self, stride, range) -> None:
+    def __init__(self, stride, range, chunk_size=1024) -> None:
         super().__init__()
         self.stride = stride
         self.range = range
+        self.chunk_size = chunk_size
 
     def defuzzify(self, data: List[FuzzySetDefuzData]) -> float:
         '''Defuzzify the data.'''
@@ -35,4 +46,353 @@ class CenterOfMassDefuz(DefuzzificationMethod):
                 max_value = max(max_value, value)
             total_area += max_value * i
             total_membership += max_value
-        return total_area / total_membership
\ No newline at end of file
+        return total_area / total_membership
+
+    def defuzzify_batch(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        '''Defuzzify a batch of cut values using the same sample points as defuzzify.'''
+        cut_values = np.asarray(cut_values, dtype=float)
+        x = self.range[0] + np.arange(int((self.range[1] - self.range[0]) / self.stride) + 1) * self.stride
+        # membership of every fuzzyset at every sample point, shape (sets, points, 1)
+        memberships = np.stack([fuzzy_set.get_values(x) for fuzzy_set in fuzzy_sets])[:, :, np.newaxis]
+        result = np.empty(len(cut_values))
+        # process the batch in chunks to bound the memory used by the (points, chunk) matrices
+        for start in range(0, len(cut_values), self.chunk_size):
+            cuts = cut_values[start:start + self.chunk_size].T[:, np.newaxis, :]
+            max_values = np.minimum(memberships, cuts).max(axis=0)
+            # summing along the first axis adds the points one by one, like defuzzify does
+            total_area = (max_values * x[:, np.newaxis]).sum(axis=0)
+            total_membership = max_values.sum(axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[start:start + self.chunk_size] = total_area / total_membership
+        return result
+
+
+class CentroidDefuz(DefuzzificationMethod):
+    '''A class to calculate the exact center of mass of the output fuzzysets in closed form.
+    The union of the cut fuzzysets is piecewise linear, so it is integrated piece by piece
+    between its breakpoints instead of being sampled. Single points have no area and are ignored.
+    The intervals between the breakpoints are found once for every list of fuzzysets, so the
+    fuzzysets must not change after they are defuzzified.'''
+
+    def __init__(self, range, chunk_size=4096) -> None:
+        super().__init__()
+        self.range = range
+        self.chunk_size = chunk_size
+        self.intervals = dict() # ids of the fuzzysets -> (fuzzysets, intervals)
+
+    def defuzzify(self, data: List[FuzzySetDefuzData]) -> float:
+        '''Defuzzify the data.'''
+        fuzzy_sets = [fuzzy_set_data.fuzzy_set for fuzzy_set_data in data]
+        cut_values = np.array([[fuzzy_set_data.cut_value for fuzzy_set_data in data]], dtype=float)
+        return float(self.defuzzify_batch(fuzzy_sets, cut_values)[0])
+
+    def defuzzify_batch(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        '''Defuzzify a batch of cut values. cut_values has one row per sample and one column per fuzzyset.'''
+        area, moment = self.get_areas_and_moments(fuzzy_sets, cut_values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return moment / area
+
+    def get_areas_and_moments(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''Returns the area of the union of the cut fuzzysets and its first moment for every row of cut values.'''
+        cut_values = np.asarray(cut_values, dtype=float)
+        intervals = self.__find_intervals(fuzzy_sets)
+        total_area = np.zeros(len(cut_values))
+        total_moment = np.zeros(len(cut_values))
+        for start in range(0, len(cut_values), self.chunk_size):
+            cuts = cut_values[start:start + self.chunk_size]
+            for (a, b), indices, slopes, intercepts in intervals:
+                area, moment = self.__integrate_interval(a, b, slopes, intercepts, cuts[:, indices])
+                total_area[start:start + self.chunk_size] += area
+                total_moment[start:start + self.chunk_size] += moment
+        return total_area, total_moment
+
+    def __find_intervals(self, fuzzy_sets: List[FuzzySet]) -> List[Tuple[Tuple[float, float], np.ndarray, np.ndarray, np.ndarray]]:
+        '''Returns the intervals of the fuzzysets like __get_intervals, they are split on the first call only.'''
+        key = tuple(id(fuzzy_set) for fuzzy_set in fuzzy_sets)
+        entry = self.intervals.get(key)
+        if entry is None:
+            # the fuzzysets are kept with their intervals, so their ids are not reused by other fuzzysets
+            entry = (list(fuzzy_sets), self.__get_intervals(fuzzy_sets))
+            self.intervals[key] = entry
+        return entry[1]
+
+    def __get_intervals(self, fuzzy_sets: List[FuzzySet]) -> List[Tuple[Tuple[float, float], np.ndarray, np.ndarray, np.ndarray]]:
+        '''Split the range at every breakpoint of the fuzzysets. In each interval every fuzzyset is a single line,
+        returns the interval with the indices, slopes and intercepts of the fuzzysets which are not 0 in it.'''
+        bounds = {self.range[0], self.range[1]}
+        for fuzzy_set in fuzzy_sets:
+            bounds.update(x for x in fuzzy_set.membership.x if self.range[0] < x < self.range[1])
+        bounds = sorted(bounds)
+        intervals = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            middle = (a + b) / 2
+            indices, slopes, intercepts = [], [], []
+            for k, fuzzy_set in enumerate(fuzzy_sets):
+                membership = fuzzy_set.membership
+                j = bisect_right(membership.x, middle) - 1
+                if 0 <= j < len(membership.x) - 1 and (membership.left[j] or membership.right[j]):
+                    slope = (membership.right[j] - membership.left[j]) / (membership.x[j + 1] - membership.x[j])
+                    indices.append(k)
+                    slopes.append(slope)
+                    intercepts.append(membership.left[j] - slope * membership.x[j])
+            if indices:
+                intervals.append(((a, b), np.array(indices), np.array(slopes), np.array(intercepts)))
+        return intervals
+
+    @staticmethod
+    def __integrate_interval(a: float, b: float, slopes: np.ndarray, intercepts: np.ndarray, cuts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''Integrate the union of the cut lines and its first moment over [a, b] for every row of cuts.'''
+        size, count = cuts.shape
+        # the union is max_k(min(line_k, cut_k)), so it can only bend where two of the lines
+        # y = slope_k * x + intercept_k or y = cut_k cross each other
+        all_slopes = np.concatenate([np.broadcast_to(slopes, (size, count)), np.zeros((size, count))], axis=1)
+        all_intercepts = np.concatenate([np.broadcast_to(intercepts, (size, count)), cuts], axis=1)
+        first, second = np.array(list(combinations(range(2 * count), 2))).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossings = (all_intercepts[:, second] - all_intercepts[:, first]) / (all_slopes[:, first] - all_slopes[:, second])
+        crossings = np.where((crossings > a) & (crossings < b), crossings, a)
+        x = np.sort(np.concatenate([np.full((size, 1), a), crossings, np.full((size, 1), b)], axis=1), axis=1)
+        # evaluate the union at the breakpoints, it is linear between two consecutive ones
+        y = np.minimum(slopes * x[:, :, np.newaxis] + intercepts, cuts[:, np.newaxis, :]).max(axis=2)
+        x0, x1, y0, y1 = x[:, :-1], x[:, 1:], y[:, :-1], y[:, 1:]
+        area = ((y0 + y1) / 2 * (x1 - x0)).sum(axis=1)
+        moment = ((x1 - x0) / 6 * (y0 * (2 * x0 + x1) + y1 * (x0 + 2 * x1))).sum(axis=1)
+        return area, moment
+
+
+class MemoizedDefuz(DefuzzificationMethod):
+    '''A class to remember the results of another defuzzification method by the cut values.
+
+    cut values can be rounded to decimals digits, then the rounded values are defuzzified so
+    every cut vector of a key gets the same result. at most max_entries results are kept, the least
+    recently used one is forgotten first. with a grid_step, the method must be a CentroidDefuz and
+    warm_up defuzzifies every combination of cut levels 0, grid_step, 2 * grid_step, ..., 1. cut
+    values between the levels are interpolated from the corners of their grid cell when the
+    interpolation error in the middle of the cell is at most max_error, the other cells are
+    defuzzified exactly. the error is only checked in the middle, other points of a cell can be
+    somewhat less accurate.'''
+
+    def __init__(self, method: DefuzzificationMethod, max_entries: int = 4096, decimals: int = None,
+                 grid_step: float = None, max_error: float = 0.01) -> None:
+        super().__init__()
+        if grid_step and not isinstance(method, CentroidDefuz):
+            raise ValueError('Only a CentroidDefuz can be interpolated from a grid')
+        self.method = method
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self.grid_step = grid_step
+        self.max_error = max_error
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.grid_sets = None
+        self.grid_values = None
+        self.accurate_cells = None
+
+    def warm_up(self, fuzzy_sets: List[FuzzySet]) -> None:
+        '''Defuzzify the grid of cut levels of the fuzzysets and find the cells which can be interpolated.'''
+        if not self.grid_step:
+            return
+        count = len(fuzzy_sets)
+        levels = np.linspace(0, 1, int(round(1 / self.grid_step)) + 1)
+        self.grid_values = self.method.defuzzify_batch(fuzzy_sets, self.__get_grid(levels, count)).reshape((len(levels),) * count)
+        self.grid_sets = [id(fuzzy_set) for fuzzy_set in fuzzy_sets]
+        # compare the interpolation with the exact centroid in the middle of every cell
+        middles = self.__get_grid((levels[:-1] + levels[1:]) / 2, count)
+        errors = np.abs(self.__interpolate(middles) - self.method.defuzzify_batch(fuzzy_sets, middles))
+        # nan, e.g. all cut values 0, is never accurate
+        self.accurate_cells = (errors <= self.max_error).reshape((len(levels) - 1,) * count)
+
+    def defuzzify(self, data: List[FuzzySetDefuzData]) -> float:
+        '''Defuzzify the data.'''
+        fuzzy_sets = [fuzzy_set_data.fuzzy_set for fuzzy_set_data in data]
+        return float(self.defuzzify_batch(fuzzy_sets, np.array([[fuzzy_set_data.cut_value for fuzzy_set_data in data]], dtype=float))[0])
+
+    def defuzzify_batch(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        '''Defuzzify a batch of cut values. remembered rows are looked up, the other rows are interpolated
+        where their grid cell is accurate enough and defuzzified together otherwise.'''
+        cut_values = np.asarray(cut_values, dtype=float).reshape(-1, len(fuzzy_sets))
+        if self.decimals is not None:
+            cut_values = np.round(cut_values, self.decimals)
+        set_ids = tuple(id(fuzzy_set) for fuzzy_set in fuzzy_sets)
+        keys = [set_ids + tuple(row) for row in cut_values.tolist()]
+        result = np.empty(len(keys))
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    result[i] = self.entries[key]
+                else:
+                    missing.append(i)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if not missing:
+            return result
+        missing_cut_values = cut_values[missing]
+        values = np.empty(len(missing))
+        interpolated = self.__can_interpolate(fuzzy_sets, missing_cut_values)
+        if interpolated.any():
+            values[interpolated] = self.__interpolate(missing_cut_values[interpolated])
+        if not interpolated.all():
+            values[~interpolated] = self.method.defuzzify_batch(fuzzy_sets, missing_cut_values[~interpolated])
+        result[missing] = values
+        with self.lock:
+            for i, value in zip(missing, values.tolist()):
+                self.entries[keys[i]] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    def clear(self) -> None:
+        '''Forget every remembered result.'''
+        with self.lock:
+            self.entries.clear()
+
+    @staticmethod
+    def __get_grid(levels: np.ndarray, count: int) -> np.ndarray:
+        '''Returns every combination of the levels for count fuzzysets, one per row.'''
+        return np.stack(np.meshgrid(*[levels] * count, indexing='ij'), axis=-1).reshape(-1, count)
+
+    def __can_interpolate(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        if self.accurate_cells is None or self.grid_sets != [id(fuzzy_set) for fuzzy_set in fuzzy_sets]:
+            return np.zeros(len(cut_values), dtype=bool)
+        cells, _ = self.__locate(cut_values)
+        return self.accurate_cells[tuple(cells.T)]
+
+    def __locate(self, cut_values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''Returns the grid cell of every cut vector and the position of the vector in its cell.'''
+        scaled = np.clip(cut_values, 0, 1) * (self.grid_values.shape[0] - 1)
+        cells = np.minimum(np.floor(scaled).astype(int), self.grid_values.shape[0] - 2)
+        return cells, scaled - cells
+
+    def __interpolate(self, cut_values: np.ndarray) -> np.ndarray:
+        '''Multilinear interpolation of the grid values at every cut vector.'''
+        cells, fractions = self.__locate(cut_values)
+        result = np.zeros(len(cut_values))
+        for corner in np.ndindex(*(2,) * cut_values.shape[1]):
+            corner = np.array(corner)
+            weights = np.prod(np.where(corner == 1, fractions, 1 - fractions), axis=1)
+            result += weights * self.grid_values[tuple((cells + corner).T)]
+        return result
+
+class WeightedAverageDefuz(DefuzzificationMethod):
+    '''A class to approximate the centroid by the average of the centroids of the output fuzzysets,
+    weighted by their areas times their cut values. it is the centroid of the sum of the fuzzysets
+    scaled by their cut values, instead of the union of the fuzzysets cut at their cut values,
+    so it only reads the area and centroid of every fuzzyset.'''
+
+    def defuzzify(self, data: List[FuzzySetDefuzData]) -> float:
+        '''Defuzzify the data.'''
+        total_area = 0
+        total_moment = 0
+        for fuzzy_set_data in data:
+            moments = fuzzy_set_data.fuzzy_set.get_moments()
+            weight = fuzzy_set_data.cut_value * moments.area
+            total_area += weight
+            total_moment += weight * moments.centroid
+        return total_moment / total_area if total_area else float('nan')
+
+    def defuzzify_batch(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        '''Defuzzify a batch of cut values. cut_values has one row per sample and one column per fuzzyset.'''
+        moments = [fuzzy_set.get_moments() for fuzzy_set in fuzzy_sets]
+        weights = np.asarray(cut_values, dtype=float) * np.array([moment.area for moment in moments])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return weights @ np.array([moment.centroid for moment in moments]) / weights.sum(axis=1)
+
+
+class HeightDefuz(DefuzzificationMethod):
+    '''A class to approximate the centroid by the average of the peaks of the output fuzzysets,
+    weighted by their cut values limited to their heights.'''
+
+    def defuzzify(self, data: List[FuzzySetDefuzData]) -> float:
+        '''Defuzzify the data.'''
+        total_weight = 0
+        total_moment = 0
+        for fuzzy_set_data in data:
+            moments = fuzzy_set_data.fuzzy_set.get_moments()
+            weight = min(fuzzy_set_data.cut_value, moments.height)
+            total_weight += weight
+            total_moment += weight * moments.peak
+        return total_moment / total_weight if total_weight else float('nan')
+
+    def defuzzify_batch(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        '''Defuzzify a batch of cut values. cut_values has one row per sample and one column per fuzzyset.'''
+        moments = [fuzzy_set.get_moments() for fuzzy_set in fuzzy_sets]
+        weights = np.minimum(np.asarray(cut_values, dtype=float), np.array([moment.height for moment in moments]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return weights @ np.array([moment.peak for moment in moments]) / weights.sum(axis=1)
+
+
+class MeanOfMaximumDefuz(DefuzzificationMethod):
+    '''A class to calculate the mean of the points where the union of the cut output fuzzysets
+    reaches its largest value. the largest value is the largest cut value limited to the height of
+    its fuzzyset, and the points are the cuts of the fuzzysets which reach it at that level, so the
+    fuzzysets are assumed to be convex. where the points have no length, their mean is the mean of
+    the middles of the cuts.'''
+
+    def defuzzify(self, data: List[FuzzySetDefuzData]) -> float:
+        '''Defuzzify the data.'''
+        levels = [min(fuzzy_set_data.cut_value, fuzzy_set_data.fuzzy_set.get_moments().height) for fuzzy_set_data in data]
+        maximum = max(levels, default=0)
+        if maximum <= 0:
+            return float('nan')
+        cuts = sorted(fuzzy_set_data.fuzzy_set.membership.get_alpha_cut(maximum)
+                      for fuzzy_set_data, level in zip(data, levels) if level == maximum)
+        length, moment, reached = 0, 0, float('-inf')
+        for low, high in cuts:
+            start = max(low, reached)
+            if high > start:
+                length += high - start
+                moment += (high ** 2 - start ** 2) / 2
+            reached = max(reached, high)
+        return moment / length if length else sum((low + high) / 2 for low, high in cuts) / len(cuts)
+
+    def defuzzify_batch(self, fuzzy_sets: List[FuzzySet], cut_values: np.ndarray) -> np.ndarray:
+        '''Defuzzify a batch of cut values. cut_values has one row per sample and one column per fuzzyset.'''
+        levels = np.minimum(np.asarray(cut_values, dtype=float),
+                            np.array([fuzzy_set.get_moments().height for fuzzy_set in fuzzy_sets]))
+        if levels.size == 0:
+            return np.full(len(levels), np.nan)
+        maximum = levels.max(axis=1)
+        lows, highs = np.empty(levels.shape), np.empty(levels.shape)
+        for k, fuzzy_set in enumerate(fuzzy_sets):
+            lows[:, k], highs[:, k] = fuzzy_set.membership.get_alpha_cuts(maximum)
+        reaching = (levels == maximum[:, np.newaxis]) & (maximum[:, np.newaxis] > 0)
+        lows, highs = np.where(reaching, lows, np.inf), np.where(reaching, highs, -np.inf)
+        # the cuts can overlap, go through them by their lower ends and count every part once
+        order = np.argsort(lows, axis=1)
+        lows, highs = np.take_along_axis(lows, order, axis=1), np.take_along_axis(highs, order, axis=1)
+        reaching = np.isfinite(lows)
+        length = np.zeros(len(levels))
+        moment = np.zeros(len(levels))
+        reached = np.full(len(levels), -np.inf)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in range(levels.shape[1]):
+                start = np.maximum(lows[:, k], reached)
+                new = highs[:, k] > start
+                length += np.where(new, highs[:, k] - start, 0)
+                moment += np.where(new, (highs[:, k] ** 2 - start ** 2) / 2, 0)
+                reached = np.maximum(reached, highs[:, k])
+            middles = np.where(reaching, (lows + highs) / 2, 0).sum(axis=1) / reaching.sum(axis=1)
+            return np.where(length > 0, moment / length, middles)
+
+
+class DefuzzifierFactory:
+    '''A class to create defuzzification methods by name. centroid is exact, the other methods
+    approximate it from the moments of the output fuzzysets.'''
+    methods = {
+        'centroid': lambda range: MemoizedDefuz(CentroidDefuz(range=range)),
+        'weighted_average': lambda range: WeightedAverageDefuz(),
+        'mean_of_maximum': lambda range: MeanOfMaximumDefuz(),
+        'height': lambda range: HeightDefuz(),
+    }
+
+    @classmethod
+    def get_defuzzifier(self, method_name: str, range: Tuple) -> DefuzzificationMethod:
+        '''Returns a new defuzzification method for an output parameter with the given range.
+        raises ValueError if there is no method with this name.'''
+        if method_name not in self.methods:
+            raise ValueError(f'Unknown defuzzification method {method_name!r}, it must be one of {", ".join(self.methods)}')
+        return self.methods[method_name](range)
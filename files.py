@@ -0,0 +1,23 @@
+'''Helpers for files which are shared between processes.'''
+import os
+import tempfile
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'w', permissions: int = 0o644):
+    '''Open a temporary file next to path and rename it to path when the block ends, so other
+    processes read either the old file or the whole new one, never half a file. the temporary
+    file is removed if the block raises.'''
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f'.{os.path.basename(path)}-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        # mkstemp creates the file readable by its owner only
+        os.chmod(temp_path, permissions)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
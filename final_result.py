@@ -1,15 +1,162 @@
-from unittest import result
+import json
+import logging
+import os
+import random
+import threading
+from dataclasses import asdict
+from typing import Dict, List, Tuple
+import numpy as np
+from defuzzification import CentroidDefuz, MemoizedDefuz
+from fuzzification import FuzzyParameter, init_output_fuzzy_sets
 from inference import FuzzyIntelligentSystem
+from result_cache import ResultCache, parse_resolutions
+
+logger = logging.getLogger(__name__)
+
+# largest number of grid points of one sweep request
+MAX_SWEEP_POINTS = 10000
+
 
 class ProvideResult(object):
+    '''A singleton which keeps one fuzzy system for the whole process. the fuzzy system is not
+    changed after it is built, so it can be shared between threads.'''
+
+    lock = threading.Lock()
+
     def __new__(cls):
         if not hasattr(cls, 'instance'):
-            cls.instance = super(ProvideResult, cls).__new__(cls)
+            with cls.lock:
+                # check again, another thread may have built the instance while we were waiting
+                if not hasattr(cls, 'instance'):
+                    instance = super(ProvideResult, cls).__new__(cls)
+                    instance.rules_file = 'rules.fcl'
+                    instance.fuzzy_system = instance.create_fuzzy_system()
+                    # fraction of the requests whose inference trace is logged, tracing is off by default
+                    instance.trace_sample_rate = float(os.environ.get('FUZZY_TRACE_SAMPLE_RATE', 0))
+                    instance.cache = instance.create_cache()
+                    cls.instance = instance
         return cls.instance
 
+    def create_fuzzy_system(self) -> FuzzyIntelligentSystem:
+        '''Build the fuzzy system with the defuzzification method and memo configured by the environment.'''
+        method = os.environ.get('FUZZY_DEFUZZ_METHOD', 'centroid')
+        use_model_cache = os.environ.get('FUZZY_MODEL_CACHE', '0') == '1'
+        optimize_rules = os.environ.get('FUZZY_OPTIMIZE_RULES', '0') == '1'
+        if method != 'centroid':
+            # the approximate methods are cheap enough without a memo
+            return FuzzyIntelligentSystem(self.rules_file, defuzzifier=method, use_model_cache=use_model_cache,
+                                          optimize_rules=optimize_rules)
+        decimals = os.environ.get('FUZZY_DEFUZZ_DECIMALS')
+        grid_step = os.environ.get('FUZZY_DEFUZZ_GRID_STEP')
+        defuzzifier = MemoizedDefuz(CentroidDefuz(range=init_output_fuzzy_sets().range),
+                                    max_entries=int(os.environ.get('FUZZY_DEFUZZ_MEMO_SIZE', 4096)),
+                                    decimals=int(decimals) if decimals else None,
+                                    grid_step=float(grid_step) if grid_step else None,
+                                    max_error=float(os.environ.get('FUZZY_DEFUZZ_MAX_ERROR', 0.01)))
+        return FuzzyIntelligentSystem(self.rules_file, defuzzifier=defuzzifier, use_model_cache=use_model_cache,
+                                      optimize_rules=optimize_rules)
+
     @staticmethod
-    def get_final_result(input_dict: dict) -> str:
-        fs = FuzzyIntelligentSystem()
-        result = fs.calculate_result(input_dict)
+    def create_cache() -> ResultCache:
+        '''Create the result cache from the environment, None if FUZZY_CACHE_SIZE is 0.'''
+        max_entries = int(os.environ.get('FUZZY_CACHE_SIZE', 10000))
+        if max_entries <= 0:
+            return None
+        ttl = os.environ.get('FUZZY_CACHE_TTL')
+        return ResultCache(max_entries=max_entries,
+                           resolutions=parse_resolutions(os.environ.get('FUZZY_CACHE_RESOLUTION', '')),
+                           ttl=float(ttl) if ttl else None,
+                           db_path=os.environ.get('FUZZY_CACHE_DB'))
+
+    def reload(self, rules_file: str = None) -> None:
+        '''Rebuild the fuzzy system after the rules or fuzzysets have changed.
+        requests which are already running keep using the old fuzzy system.'''
+        with self.lock:
+            if rules_file is not None:
+                self.rules_file = rules_file
+            self.fuzzy_system = self.create_fuzzy_system()
+
+    def get_final_result(self, input_dict: dict, method: str = None) -> str:
+        '''Returns the status and the result of an input dictionary, defuzzified with the method of the
+        given name or the default method of the fuzzy system.'''
+        return self.get_final_result_and_cut_values(input_dict, method)[0]
+
+    def get_final_result_and_cut_values(self, input_dict: dict, method: str = None) -> Tuple[str, Dict[str, float]]:
+        '''Returns the status and the result of an input dictionary like get_final_result, and the cut value
+        of every output fuzzyset from the same evaluation. raises ValueError if an input is missing,
+        is not a number or is out of range.'''
+        fs = self.fuzzy_system
+        tracing = self.trace_sample_rate and random.random() < self.trace_sample_rate
+        if self.cache is not None and not tracing:
+            result, message, cut_values = self.cache.get_result_and_cut_values(fs, input_dict, method)
+            return f'{message}: {result}', cut_values
+        # the cache validates its inputs, the fuzzy system does not check the ranges
+        values = fs.validate_input(input_dict)
+        if tracing:
+            trace = fs.explain(values, method)
+            logger.info('inference trace: %s', json.dumps(asdict(trace)))
+            result, cut_values = trace.result, trace.cut_values
+        else:
+            result, cut_values = fs.calculate_result_and_cut_values(values, method)
         message = fs.get_health_status(result)
-        return f'{message}: {result}'
\ No newline at end of file
+        return f'{message}: {result}', cut_values
+
+    def get_trace(self, input_dict: dict, method: str = None) -> dict:
+        '''Calculate the result of an input dictionary with its memberships, rule strengths and cut values.'''
+        fs = self.fuzzy_system
+        fs.validate_input(input_dict)
+        return asdict(fs.explain(input_dict, method))
+
+    def get_batch_results(self, records: List[dict], method: str = None) -> List[dict]:
+        '''Calculate the results of a list of input dictionaries in one batch.
+        every result is either {'result': ..., 'status': ...} or {'error': ...}.'''
+        fs = self.fuzzy_system
+        outputs = [None] * len(records)
+        # records which are not dictionaries can not be scored, the rest are scored together
+        indices = [i for i, record in enumerate(records) if isinstance(record, dict)]
+        valid_records = [records[i] for i in indices]
+        if self.cache is not None:
+            scored = self.cache.get_results(fs, valid_records, method)
+        else:
+            scored = fs.calculate_records(valid_records, method)
+        for i, (result, status, error) in zip(indices, scored):
+            outputs[i] = {'error': error} if error is not None else {'result': result, 'status': status}
+        for i, output in enumerate(outputs):
+            if output is None:
+                outputs[i] = {'error': 'Record must be an object'}
+        return outputs
+
+    def get_sweep(self, input_dict: dict, sweep: dict, method: str = None) -> dict:
+        '''Calculate the score curve of an input dictionary while the swept parameters change.
+        every value of sweep is either a list of values or {'start': ..., 'stop': ..., 'num': ...}.
+        raises ValueError if an input or a sweep is not valid.'''
+        if not isinstance(sweep, dict):
+            raise ValueError('Sweep must be an object of parameter values')
+        values = dict()
+        for name, spec in sweep.items():
+            if isinstance(spec, dict):
+                try:
+                    start, stop, num = float(spec['start']), float(spec['stop']), int(spec.get('num', 101))
+                except (KeyError, TypeError, ValueError):
+                    raise ValueError(f'Sweep of parameter {name} must have numbers start, stop and num') from None
+                if not 0 < num <= MAX_SWEEP_POINTS:
+                    raise ValueError(f'Sweep of parameter {name} must have between 1 and {MAX_SWEEP_POINTS} points')
+                spec = np.linspace(start, stop, num).tolist()
+            if not isinstance(spec, list):
+                raise ValueError(f'Sweep of parameter {name} must be a list or a range')
+            values[name] = spec
+        if int(np.prod([len(spec) for spec in values.values()])) > MAX_SWEEP_POINTS:
+            raise ValueError(f'Sweep has more than {MAX_SWEEP_POINTS} points')
+        results, statuses = self.fuzzy_system.sweep(input_dict, values, method)
+        return {'parameters': list(values),
+                'values': {name: np.asarray(spec, dtype=float).tolist() for name, spec in values.items()},
+                'results': results.tolist(),
+                'statuses': np.array(statuses, dtype=object).reshape(results.shape).tolist()}
+
+    def get_parameter(self, name: str) -> FuzzyParameter:
+        '''Returns the input or output parameter with the given name or name in rules, None if there is none.'''
+        fs = self.fuzzy_system
+        for param in list(fs.fuzzy_parameters.values()) + [fs.output_param]:
+            if name in (param.name, param.name_in_rules):
+                return param
+        return None
@@ -1,6 +1,7 @@
 from abc import abstractmethod, ABC
-from typing import Tuple, List
-import matplotlib.pyplot as plt
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, Tuple, List
 import numpy as np
 
 class FuzzySetSection(ABC):
@@ -19,6 +20,8 @@ class FuzzySetSection(ABC):
 class Point(FuzzySetSection):
     '''This is a class to define a point in a fuzzyset. this section can be a point.'''
 
+    __slots__ = ('x', 'value')
+
     def __init__(self, x: float, value: float):
         self.x = x
         self.value = value
@@ -33,63 +36,232 @@ class Point(FuzzySetSection):
 
 class Line(FuzzySetSection):
     '''This is a class to define a line in a fuzzyset.'''
+
+    __slots__ = ('start_pos', 'end_pos')
+
     def __init__(self, start_pos: Tuple, end_pos: Tuple) -> None:
         # put start_pos and end_pos in order
         if start_pos[0] < end_pos[0]:
             self.start_pos = start_pos
             self.end_pos = end_pos
-        else:
+        elif start_pos[0] > end_pos[0]:
             self.start_pos = end_pos
             self.end_pos = start_pos
-        # find the line parameters
-        self.m, self.b = self.__find_line_paramaters(self.start_pos[0], self.start_pos[1], self.end_pos[0], self.end_pos[1])
+        else:
+            raise ValueError('Line can not be vertical')
 
     def get_value(self, x: float) -> float:
-        return self.m * x + self.b
+        # interpolate from the end points so the value at both of them is exact
+        (x1, y1), (x2, y2) = self.start_pos, self.end_pos
+        return y1 + (x - x1) * (y2 - y1) / (x2 - x1)
     
     def range(self) -> Tuple:
         return self.start_pos[0], self.end_pos[0]
-    
-    def __find_line_paramaters(self, x1: int, y1: int, x2: int, y2: int) -> Tuple:
-        weights = np.array([[x1, 1], [x2, 1]])
-        out = np.array([y1, y2])
-        result = np.linalg.solve(weights, out)
-        return result[0], result[1]
+
+@dataclass(frozen=True)
+class FuzzySetMoments:
+    '''A class to represent the shape of a fuzzyset for the approximate defuzzification methods.
+    area and centroid are those of the area under the fuzzyset, height is its largest value and
+    peak is the middle of the points where it reaches its height.'''
+    area: float
+    centroid: float
+    height: float
+    peak: float
+
+class MembershipFunction:
+    '''This is a class to define a piecewise linear membership function with sorted breakpoints.
+    y holds the value at each breakpoint and left/right hold the values at the two ends of the
+    interval between two breakpoints, so jumps, gaps and single points need no special case.
+    the value is 0 outside the breakpoints. the tuples are copied to arrays by the first batch call.'''
+
+    __slots__ = ('x', 'y', 'left', 'right', 'arrays')
+
+    def __init__(self, x: Tuple, y: Tuple, left: Tuple, right: Tuple) -> None:
+        self.x = x
+        self.y = y
+        self.left = left
+        self.right = right
+        self.arrays = None
+
+    def get_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''Returns x, y, left and right as arrays, they are built once.'''
+        if self.arrays is None:
+            self.arrays = tuple(np.array(values, dtype=float) for values in (self.x, self.y, self.left, self.right))
+        return self.arrays
+
+    @classmethod
+    def from_sections(cls, sections: List[FuzzySetSection]) -> 'MembershipFunction':
+        '''Builds the membership function of a list of sections. where sections touch, the first one
+        in the list gives the value.'''
+        x = sorted({bound for section in sections for bound in section.range()})
+        y = tuple(float(cls.__find_value(sections, bound)) for bound in x)
+        left, right = [], []
+        for x1, x2 in zip(x[:-1], x[1:]):
+            # an interval is covered by one section or lies in a gap between sections
+            section = cls.__find_section(sections, (x1 + x2) / 2)
+            left.append(float(section.get_value(x1)) if section else 0.0)
+            right.append(float(section.get_value(x2)) if section else 0.0)
+        return cls(tuple(float(bound) for bound in x), y, tuple(left), tuple(right))
+
+    def get_sections(self) -> List[FuzzySetSection]:
+        '''Returns sections which from_sections turns back into this function. intervals which are 0
+        are left out, a breakpoint whose value is not the end of the line before it gets a point,
+        and the points come first so they give the value there.'''
+        lines = [j for j in range(len(self.x) - 1) if self.left[j] or self.right[j]]
+        ends = dict()
+        for j in lines:
+            ends.setdefault(j, self.left[j])
+            ends.setdefault(j + 1, self.right[j])
+        points = [Point(x, y) for i, (x, y) in enumerate(zip(self.x, self.y)) if ends.get(i, 0.0) != y]
+        return points + [Line((self.x[j], self.left[j]), (self.x[j + 1], self.right[j])) for j in lines]
+
+    @staticmethod
+    def __find_section(sections: List[FuzzySetSection], x: float) -> FuzzySetSection:
+        for section in sections:
+            if section.range()[0] <= x <= section.range()[1]:
+                return section
+        return None
+
+    @classmethod
+    def __find_value(cls, sections: List[FuzzySetSection], x: float) -> float:
+        section = cls.__find_section(sections, x)
+        return section.get_value(x) if section else 0
+
+    def get_value(self, x: float) -> float:
+        '''Returns the value of the function at x using binary search.'''
+        i = bisect_left(self.x, x)
+        if i < len(self.x) and self.x[i] == x:
+            return self.y[i]
+        if i == 0 or i == len(self.x):
+            return 0
+        j = i - 1
+        return self.left[j] + (x - self.x[j]) * (self.right[j] - self.left[j]) / (self.x[i] - self.x[j])
+
+    def get_values(self, x: np.ndarray) -> np.ndarray:
+        '''Returns the values of the function at every element of x.'''
+        x = np.asarray(x, dtype=float)
+        result = np.zeros(x.shape)
+        if len(self.x) == 0:
+            return result
+        xp, yp, left, right = self.get_arrays()
+        i = np.searchsorted(xp, x)
+        nearest = np.minimum(i, len(xp) - 1)
+        exact = xp[nearest] == x
+        inside = (i > 0) & (i < len(xp)) & ~exact
+        j = i[inside] - 1
+        result[inside] = left[j] + (x[inside] - xp[j]) * (right[j] - left[j]) / (xp[j + 1] - xp[j])
+        result[exact] = yp[nearest[exact]]
+        return result
+
+    def get_moments(self) -> FuzzySetMoments:
+        '''Returns the area, centroid, height and peak of the function. the area and its first moment
+        are integrated between the breakpoints in closed form, a function without area, like a single
+        point, has its peak as centroid.'''
+        area, moment = 0.0, 0.0
+        for j in range(len(self.x) - 1):
+            x0, x1, y0, y1 = self.x[j], self.x[j + 1], self.left[j], self.right[j]
+            area += (y0 + y1) / 2 * (x1 - x0)
+            moment += (x1 - x0) / 6 * (y0 * (2 * x0 + x1) + y1 * (x0 + 2 * x1))
+        height = max(self.y + self.left + self.right, default=0.0)
+        top = [x for x, y in zip(self.x, self.y) if y == height]
+        top += [x for x, y in zip(self.x, self.left) if y == height] + [x for x, y in zip(self.x[1:], self.right) if y == height]
+        peak = (min(top) + max(top)) / 2 if top else float('nan')
+        return FuzzySetMoments(area, moment / area if area else peak, height, peak)
+
+    def get_alpha_cut(self, level: float) -> Tuple[float, float]:
+        '''Returns the lowest and the highest x where the function is at least the level, like get_alpha_cuts for one level.'''
+        low, high = float('inf'), float('-inf')
+        for x, y in zip(self.x, self.y):
+            if y >= level:
+                low, high = min(low, x), max(high, x)
+        for j in range(len(self.x) - 1):
+            x0, x1, left, right = self.x[j], self.x[j + 1], self.left[j], self.right[j]
+            if left >= level or right >= level:
+                crossing = x0 + (level - left) / (right - left) * (x1 - x0) if (left < level or right < level) else None
+                low = min(low, x0 if left >= level else crossing)
+                high = max(high, x1 if right >= level else crossing)
+        return low, high
+
+    def get_alpha_cuts(self, levels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''Returns the lowest and the highest x where the function is at least the level, for every
+        level. they are inf and -inf where the function is below the level everywhere. for a convex
+        fuzzyset every x between them is in the cut.'''
+        levels = np.asarray(levels, dtype=float)[:, np.newaxis]
+        low = np.full(len(levels), np.inf)
+        high = np.full(len(levels), -np.inf)
+        if len(self.x) == 0:
+            return low, high
+        x, y, left, right = self.get_arrays()
+        low = np.where(y >= levels, x, np.inf).min(axis=1)
+        high = np.where(y >= levels, x, -np.inf).max(axis=1)
+        if len(self.x) > 1:
+            x0, x1 = x[:-1], x[1:]
+            # where a line crosses the level, it is only used when one of its ends is below the level
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossings = x0 + (levels - left) / (right - left) * (x1 - x0)
+            low = np.minimum(low, np.where(left >= levels, x0, np.where(right >= levels, crossings, np.inf)).min(axis=1))
+            high = np.maximum(high, np.where(right >= levels, x1, np.where(left >= levels, crossings, -np.inf)).max(axis=1))
+        return low, high
 
 def linspace(start: float, end: float, stride: int) -> List:
     '''Returns a list of floats between start and end with stride.'''
     return [start + i * stride for i in range(int((end - start) / stride) + 1)]
 
 class FuzzySet:
-    '''This is a class to define a fuzzyset.'''
+    '''This is a class to define a fuzzyset. only its membership function is kept, the sections
+    are derived from it.'''
     def __init__(self, name:str) -> None:
         self.name = name
         self.parameter = None
-        self.sections = []
+        self.membership = MembershipFunction((), (), (), ())
+        self.moments = None
+
+    @property
+    def sections(self) -> List[FuzzySetSection]:
+        return self.membership.get_sections()
 
     def add(self, section: FuzzySetSection) -> None:
         '''Adds a section to the fuzzyset.'''
-        # Check if the section has an intersection with other sections
-        for s in self.sections:
-            if self.__has_interception(s.range(), section.range()):
-                raise ValueError('Interception between sections')
-        self.sections.append(section)
+        self.add_sections([section])
+
+    def add_sections(self, sections: List[FuzzySetSection]) -> None:
+        '''Adds sections to the fuzzyset and builds its membership function once for all of them.'''
+        all_sections = self.sections
+        for section in sections:
+            # Check if the section has an intersection with other sections
+            for s in all_sections:
+                if self.__has_interception(s.range(), section.range()):
+                    raise ValueError('Interception between sections')
+            all_sections.append(section)
+        self.membership = MembershipFunction.from_sections(all_sections)
+        self.moments = None
     
     def get_value(self, x: float) -> float:
         '''Returns the value of the fuzzyset at x.'''
         # raise error if x is not in the range and x is assigned to a parameter
         if self.parameter:
             if x < self.parameter.range[0] or x > self.parameter.range[1]:
-                return ValueError('x out of range')
-        # find the section that contains x to get the value
-        for section in self.sections:
-            if section.range()[0] <= x <= section.range()[1]:
-                return section.get_value(x)
-        return 0
+                raise ValueError('x out of range')
+        return self.membership.get_value(x)
+
+    def get_values(self, x: np.ndarray) -> np.ndarray:
+        '''Returns the values of the fuzzyset at every element of x.'''
+        x = np.asarray(x, dtype=float)
+        # raise error if any x is not in the range and x is assigned to a parameter
+        if self.parameter:
+            if np.any((x < self.parameter.range[0]) | (x > self.parameter.range[1])):
+                raise ValueError('x out of range')
+        return self.membership.get_values(x)
     
     def get_cut_value(self, x: float, cut: float):
         return min(cut, self.get_value(x))
 
+    def get_moments(self) -> FuzzySetMoments:
+        '''Returns the area, centroid, height and peak of the fuzzyset, they are calculated once.'''
+        if self.moments is None:
+            self.moments = self.membership.get_moments()
+        return self.moments
+
     def __has_interception(self, range1: Tuple, range2: Tuple) -> bool:
         if range2[0] < range1[1] < range2[1] or range1[0] < range2[1] < range1[1]:
             return True
@@ -109,8 +281,7 @@ class FuzzyParameter:
         if name in self.sets:
             raise ValueError('Set already exists')
         our_set = FuzzySet(name)
-        for i in range(len(points) - 1):
-            our_set.add(Line((points[i][0], points[i][1]), (points[i+1][0], points[i+1][1])))
+        our_set.add_sections([Line((points[i][0], points[i][1]), (points[i+1][0], points[i+1][1])) for i in range(len(points) - 1)])
         self.sets[our_set.name] = our_set
         our_set.parameter = self
 
@@ -119,18 +290,43 @@ class FuzzyParameter:
         self.sets[our_set.name] = our_set
         our_set.parameter = self
     
+    def get_plot_values(self, cut_values: dict = None, samples: int = 2000) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        '''Returns the x and y arrays to plot every fuzzyset, cut at its cut value if one is given.
+        x has evenly spaced samples and the breakpoints of the set, so corners and points are exact.'''
+        grid = np.linspace(self.range[0], self.range[1], samples)
+        values = dict()
+        for set_name, set in self.sets.items():
+            x = np.union1d(grid, [bound for bound in set.membership.x if self.range[0] <= bound <= self.range[1]])
+            y = set.membership.get_values(x)
+            if cut_values is not None and set_name in cut_values:
+                y = np.minimum(y, cut_values[set_name])
+            values[set_name] = (x, y)
+        return values
+
     def plot(self, cut_values: dict = None) -> None:
         '''Plots the parameter's fuzzysets.'''
-        x = linspace(self.range[0], self.range[1], 0.005)
-        for set_name, set in self.sets.items():
-            y = [set.get_value(_x) for _x in x] if (cut_values is None or set_name not in cut_values) \
-                else [set.get_cut_value(x_, cut_values[set_name]) for x_ in x]
-            plt.plot(x, y, label=f'{self.name}_{set_name}')
-        plt.xlim(self.range[0] - 0.1, self.range[1] + 0.1)
-        plt.legend(loc='best')
-        plt.title(f'{self.name}')
+        # matplotlib is slow to import and only needed for plots
+        import matplotlib.pyplot as plt
+        figure, axes = plt.subplots()
+        self.__draw(axes, cut_values)
         plt.show()
-    
+
+    def render(self, file, cut_values: dict = None, format: str = 'png') -> None:
+        '''Renders the plot of the parameter's fuzzysets to a file name or a binary file object
+        without a display, so it can run in a server.'''
+        # a figure without pyplot has no global state and does not need a GUI backend
+        from matplotlib.figure import Figure
+        figure = Figure()
+        self.__draw(figure.subplots(), cut_values)
+        figure.savefig(file, format=format)
+
+    def __draw(self, axes, cut_values: dict) -> None:
+        for set_name, (x, y) in self.get_plot_values(cut_values).items():
+            axes.plot(x, y, label=f'{self.name}_{set_name}')
+        axes.set_xlim(self.range[0] - 0.1, self.range[1] + 0.1)
+        axes.legend(loc='best')
+        axes.set_title(f'{self.name}')
+
     def get_value(self, x: float) -> dict:
         '''Returns the value of the parameter at x for every fuzzysets.'''
         result = dict()
@@ -141,7 +337,36 @@ class FuzzyParameter:
     def get_value_in_set(self, x: float, set_name: str) -> float:
         '''Returns the value of the parameter at x in the fuzzyset with the given name.'''
         return self.sets[set_name].get_value(x)
+
+    def get_values_in_set(self, x: np.ndarray, set_name: str) -> np.ndarray:
+        '''Returns the values of the parameter at every element of x in the fuzzyset with the given name.'''
+        return self.sets[set_name].get_values(x)
+
+    def get_moments(self) -> Dict[str, FuzzySetMoments]:
+        '''Returns the area, centroid, height and peak of every fuzzyset of the parameter.'''
+        return {set_name: set.get_moments() for set_name, set in self.sets.items()}
     
+    @classmethod
+    def from_definition(cls, definition: dict) -> 'FuzzyParameter':
+        '''Builds a parameter from the output of get_definition. its fuzzysets get their membership
+        functions from the breakpoints.'''
+        param = cls(definition['name'], tuple(definition['range']), name_in_rules=definition['name_in_rules'])
+        for set_name, (x, y, left, right) in definition['sets'].items():
+            our_set = FuzzySet(set_name)
+            our_set.membership = MembershipFunction(tuple(x), tuple(y), tuple(left), tuple(right))
+            param.add_set(our_set)
+        return param
+
+    def get_definition(self) -> dict:
+        '''Returns the name, range and membership breakpoints of the parameter as plain data.'''
+        return {
+            'name': self.name,
+            'name_in_rules': self.name_in_rules,
+            'range': list(self.range),
+            'sets': {set_name: [list(set.membership.x), list(set.membership.y), list(set.membership.left), list(set.membership.right)]
+                     for set_name, set in self.sets.items()},
+        }
+
     def __str__(self) -> str:
         return f'{self.name}: sets: {len(self.sets)}'
 
@@ -282,6 +507,8 @@ def init_output_fuzzy_sets():
     output_param.create_set('sick_2', [(1, 0), (2, 1), (3,0)])
     output_param.create_set('sick_3', [(2, 0), (3, 1), (4,0)])
     output_param.create_set('sick_4', [(3, 0), (3.75, 1), (4, 1)])
+    # the approximate defuzzification methods read the moments of the output fuzzysets on every call
+    output_param.get_moments()
     return output_param
 
 if __name__ == '__main__':
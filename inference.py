@@ -1,139 +1,372 @@
 from fuzzification import init_fuzzy_parameters, init_output_fuzzy_sets
 from abc import ABC, abstractmethod
-from typing import Tuple, List
+import hashlib
+import json
+from typing import Tuple, List, Dict, Union
 from dataclasses import dataclass
-from rule_parser import RuleParser
-from defuzzification import CenterOfMassDefuz, FuzzySetDefuzData
+import numpy as np
+from rule_parser import Expression, OperatorExpression, RuleParser, TermExpression
+from compiled_rules import CompiledRulebase
+import model_cache
+import rule_analysis
+from metrics import metrics
+from defuzzification import DefuzzificationMethod, DefuzzifierFactory, FuzzySetDefuzData, MemoizedDefuz
 
 class FuzzyOperator(ABC):
-    '''An abstract class to represent a fuzzy operator'''
-    def __init__(self, name: str) -> None:
+    '''An abstract class to represent a fuzzy operator. absorbing_value is the operand value
+    which decides the result alone, so the other operands do not have to be calculated.'''
+    def __init__(self, name: str, absorbing_value: float = None) -> None:
         self.name = name
+        self.absorbing_value = absorbing_value
     
     @abstractmethod
     def get_fuzzy_value(self, operand1:float, operand2:float) -> float:
         '''Calculate the fuzzy value of 2 operands.'''
         pass
 
+    @abstractmethod
+    def get_fuzzy_values(self, operand1: np.ndarray, operand2: np.ndarray) -> np.ndarray:
+        '''Calculate the element-wise fuzzy values of 2 arrays of operands.'''
+        pass
+
 class AndOperator(FuzzyOperator):
     '''A class to represent the AND operator'''
     def __init__(self) -> None:
-        super().__init__('AND')
+        super().__init__('AND', absorbing_value=0)
     
     def get_fuzzy_value(self, operand1: float, operand2: float) -> float:
         return min(operand1, operand2)
 
+    def get_fuzzy_values(self, operand1: np.ndarray, operand2: np.ndarray) -> np.ndarray:
+        return np.minimum(operand1, operand2)
+
 class OrOperator(FuzzyOperator):
     '''A class to represent the OR operator'''
     def __init__(self) -> None:
-        super().__init__('OR')
+        super().__init__('OR', absorbing_value=1)
     
     def get_fuzzy_value(self, operand1: float, operand2: float) -> float:
         return max(operand1, operand2)
 
+    def get_fuzzy_values(self, operand1: np.ndarray, operand2: np.ndarray) -> np.ndarray:
+        return np.maximum(operand1, operand2)
+
+class NotOperator(FuzzyOperator):
+    '''A class to represent the NOT operator, it has one operand so operand2 is not used.'''
+    def __init__(self) -> None:
+        super().__init__('NOT')
+
+    def get_fuzzy_value(self, operand1: float, operand2: float = None) -> float:
+        return 1 - operand1
+
+    def get_fuzzy_values(self, operand1: np.ndarray, operand2: np.ndarray = None) -> np.ndarray:
+        return 1 - operand1
+
 class OperatorFactory:
     '''A class to create fuzzy operators.'''
-    operators = {'AND': AndOperator(), 'OR': OrOperator()}
+    operators = {'AND': AndOperator(), 'OR': OrOperator(), 'NOT': NotOperator()}
     
     @classmethod
     def get_operator(self, operator_name: str) -> FuzzyOperator:
         return self.operators[operator_name]
 
-@dataclass
+@dataclass(frozen=True)
 class RuleTerm:
     '''A class to represent a rule term which is a tuple like (parameter_name, fuzzyset_name)'''
     parameter_name: str
     fuzzyset_name: str
 
 class Rule:
-    '''A class to represent a rule which has a if clause, a then clause and an operator.'''
-    def __init__(self, if_clause: List, then_clause: Tuple) -> None:
-        self.if_clause_items = []
+    '''A class to represent a rule which has a condition, a then clause and the line of the rules file
+    it was read from. if_clause_items are the distinct terms of the condition and operator is the
+    operator at the top of the condition, None if the condition is a single term.'''
+    def __init__(self, condition: Expression, then_clause: Tuple, line_number: int = None) -> None:
+        self.condition = condition
         self.then_clause_item = RuleTerm(then_clause[0], then_clause[1])
-        self.operator = None
-        for term in if_clause:
-            if isinstance(term, Tuple):
-                self.if_clause_items.append(RuleTerm(term[0], term[1]))
-            elif not self.operator:
-                self.operator = OperatorFactory.get_operator(term)
-    
+        self.line_number = line_number
+        self.if_clause_items = list(dict.fromkeys(self.__get_terms(condition)))
+        self.operator = OperatorFactory.get_operator(condition.operator) if isinstance(condition, OperatorExpression) else None
+
+    @classmethod
+    def __get_terms(cls, expression: Expression) -> List[RuleTerm]:
+        if isinstance(expression, TermExpression):
+            return [RuleTerm(expression.parameter_name, expression.fuzzyset_name)]
+        return [term for operand in expression.operands for term in cls.__get_terms(operand)]
+
     def __str__(self) -> str:
-        return '{} {} {}'.format(self.if_clause_items, self.operator, self.then_clause_item)
+        return 'IF {} THEN {} IS {}'.format(self.condition, self.then_clause_item.parameter_name, self.then_clause_item.fuzzyset_name)
+
+@dataclass
+class TermTrace:
+    '''A class to represent the membership value of a rule term in an inference trace.'''
+    parameter_name: str
+    fuzzyset_name: str
+    membership: float
+
+@dataclass
+class RuleTrace:
+    '''A class to represent the firing strength of a rule in an inference trace.'''
+    terms: List[RuleTerm]
+    operator: str
+    condition: str
+    consequent: str
+    strength: float
+
+@dataclass
+class InferenceTrace:
+    '''A class to represent every intermediate value of one calculation of the fuzzy system.'''
+    memberships: List[TermTrace]
+    rules: List[RuleTrace]
+    cut_values: Dict[str, float]
+    result: float
+    status: str
 
 class FuzzyIntelligentSystem:
     '''A class to represent a fuzzy intelligent system. this class is used to calculate 
     the fuzzy values of the output parameters'''
 
-    def __init__(self, rules_file='rules.fcl') -> None:
+    def __init__(self, rules_file='rules.fcl', defuzzifier: Union[DefuzzificationMethod, str] = None, use_model_cache: bool = False,
+                 optimize_rules: bool = False) -> None:
         self.fuzzy_rules = [] # type: List[Rule]
-        self.__extract_rules(rules_file) 
         self.fuzzy_parameters = dict()
-        self.output_param = init_output_fuzzy_sets()
-        for param in init_fuzzy_parameters():
+        # the saved model skips parsing the rules and building the fuzzysets while it is fresh, it is
+        # only read and written when asked for, a construction saves about a millisecond with it
+        model = model_cache.load_model(rules_file) if use_model_cache else None
+        if model is not None:
+            parsed_rules, params, self.output_param = model
+        else:
+            parsed_rules = self.__extract_rules(rules_file)
+            params, self.output_param = init_fuzzy_parameters(), init_output_fuzzy_sets()
+            if use_model_cache:
+                model_cache.save_model(rules_file, parsed_rules, params, self.output_param)
+        for line_number, condition, then_clause in parsed_rules:
+            self.fuzzy_rules.append(Rule(condition, then_clause, line_number))
+        for param in params:
             self.fuzzy_parameters[param.name_in_rules] = param
+        # number of every rule in the rules file, the metrics of the rules are labeled with it
+        self.rule_numbers = list(range(1, len(self.fuzzy_rules) + 1))
+        self.rule_report = None
+        if optimize_rules:
+            # duplicate and subsumed rules do not change the result, rules which can not be evaluated are errors now
+            optimized_rules, self.rule_report = rule_analysis.optimize_rules(self.fuzzy_rules, self.fuzzy_parameters, self.output_param)
+            if self.rule_report.undefined:
+                raise ValueError('; '.join(f'line {finding.line_number}: {finding.reason}' for finding in self.rule_report.undefined))
+            self.fuzzy_rules = optimized_rules
+            self.rule_numbers = [index + 1 for index in self.rule_report.kept]
+        self.compiled_rules = CompiledRulebase(self.fuzzy_rules, self.fuzzy_parameters, self.output_param, OperatorFactory.operators)
+        # the default is the centroid with a memo of every cut vector, most requests repeat a few of them
+        if defuzzifier is None or isinstance(defuzzifier, str):
+            defuzzifier = DefuzzifierFactory.get_defuzzifier(defuzzifier or 'centroid', self.output_param.range)
+        self.defuzzifier = defuzzifier
+        if isinstance(self.defuzzifier, MemoizedDefuz):
+            self.defuzzifier.warm_up([self.output_param.sets[key] for key in self.compiled_rules.consequents])
+        # defuzzification methods requested by name, created when they are first used
+        self.defuzzifiers = dict() # type: Dict[str, DefuzzificationMethod]
+        self.fingerprint = self.__get_fingerprint()
 
-    def __extract_rules(self, rules_file) -> None:
+    def __get_fingerprint(self) -> str:
+        '''Returns a hash of the rules and the fuzzyset definitions, it changes whenever any of them changes.'''
+        definition = {
+            'rules': [str(rule) for rule in self.fuzzy_rules],
+            'parameters': [param.get_definition() for param in self.fuzzy_parameters.values()],
+            'output': self.output_param.get_definition(),
+        }
+        return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+    def get_defuzzifier(self, method: str = None) -> DefuzzificationMethod:
+        '''Returns the defuzzification method with the given name, the default one of the system if it is None.
+        raises ValueError if there is no method with this name.'''
+        if method is None:
+            return self.defuzzifier
+        defuzzifier = self.defuzzifiers.get(method)
+        if defuzzifier is None:
+            # two threads may both create it, either one is kept
+            defuzzifier = self.defuzzifiers.setdefault(method, DefuzzifierFactory.get_defuzzifier(method, self.output_param.range))
+        return defuzzifier
+
+    @staticmethod
+    def __extract_rules(rules_file) -> List[Tuple[int, Expression, Tuple[str, str]]]:
         '''Extract rules from a file.'''
         with open(rules_file, 'r') as f:
-            # loop through each line
-            for line in f:
-                # parse the line to get the if clause and then clause
-                if_clause, then_clause = RuleParser.parse_rule(line[:-1])
-                # create a rule
-                self.fuzzy_rules.append(Rule(if_clause, then_clause))
-
-    def calculate_result(self, input_dict: dict) -> float:
-        '''Calculate the fuzzy value of the output parameter given an input dictionary.'''
-        # init max_value for each output fuzzy set
-        max_values = dict()
-        for key in self.output_param.sets.keys():
-            max_values[key] = 0
-        # calculate the output with respect to the rules
-        for rule in self.fuzzy_rules:
-            result_value = 0
-            term = rule.if_clause_items[0]
-            # calculate the result for the first term in the if clause
-            if term.parameter_name in input_dict:
-                # check if the parameter is in the fuzzy system or not
-                if term.parameter_name in self.fuzzy_parameters:
-                    # if the parameter is in the fuzzy system, calculate the fuzzy value
-                    result_value = self.fuzzy_parameters[term.parameter_name].get_value_in_set(
-                        float(input_dict[term.parameter_name]), term.fuzzyset_name)
-                    print(f'({term.parameter_name} {term.fuzzyset_name} {result_value}) ', end='')
-                else:
-                    raise ValueError(f'Parameter {term.parameter_name} is not in fuzzy parameters')
-            else:
-                raise ValueError(f'Parameter {term.parameter_name} is not in input dict')
-            
-            # calculate the result for the rest of the terms in the if clause
-            for i, term in enumerate(rule.if_clause_items[1:]):
-                # check if the parameter is in the input dictionary or not
-                if term.parameter_name in input_dict:
-                    # check if the parameter is in the fuzzy system or not
-                    if term.parameter_name in self.fuzzy_parameters:
-                        # if the parameter is in the fuzzy system, calculate the fuzzy value
-                        term_value = self.fuzzy_parameters[term.parameter_name].get_value_in_set(
-                            int(input_dict[term.parameter_name]), term.fuzzyset_name)
-                        print(f'({term.parameter_name} {term.fuzzyset_name} {term_value}) ', end='')
-                        # update the result value using the fuzzy operator
-                        result_value = rule.operator.get_fuzzy_value(result_value, term_value)
-                    else:
-                        raise ValueError(f'Parameter {term.parameter_name} is not in fuzzy parameters')
-                else:
-                    raise ValueError(f'Parameter {term.parameter_name} is not in input dict')
-
-            print(f'=> ({rule.then_clause_item.fuzzyset_name} {result_value})')
-            # update the max value of the output fuzzy set if the result is greater than the current max value
-            if result_value > max_values[rule.then_clause_item.fuzzyset_name]:
-                max_values[rule.then_clause_item.fuzzyset_name] = result_value
-
-        print(max_values)
-        # self.output_param.plot(cut_values=max_values)
+            # parse every line to get the condition and then clause, a malformed rule raises RuleSyntaxError
+            return RuleParser.parse_rules(f)
+
+    def validate_input(self, input_dict: dict) -> Dict[str, float]:
+        '''Convert the inputs of the parameters used in the rules to floats and check their ranges.
+        raises ValueError if the input is not a dictionary or if an input is missing, is not a number
+        or is out of range.'''
+        if not isinstance(input_dict, dict):
+            raise ValueError(f'Input must be an object of parameter values, not {type(input_dict).__name__}')
+        values = dict()
+        for name in self.compiled_rules.parameter_names:
+            if name not in input_dict:
+                raise ValueError(f'Parameter {name} is not in input dict')
+            if name not in self.fuzzy_parameters:
+                raise ValueError(f'Parameter {name} is not in fuzzy parameters')
+            try:
+                value = float(input_dict[name])
+            except (TypeError, ValueError):
+                raise ValueError(f'Parameter {name} is not a number: {input_dict[name]!r}') from None
+            param_range = self.fuzzy_parameters[name].range
+            if not param_range[0] <= value <= param_range[1]:
+                raise ValueError(f'Parameter {name} is out of range [{param_range[0]}, {param_range[1]}]: {value}')
+            values[name] = value
+        return values
+
+    def calculate_result(self, input_dict: dict, method: str = None) -> float:
+        '''Calculate the fuzzy value of the output parameter given an input dictionary. method is the
+        name of the defuzzification method, the default one of the system is used if it is None.'''
+        return self.calculate_result_and_cut_values(input_dict, method)[0]
+
+    def calculate_result_and_cut_values(self, input_dict: dict, method: str = None) -> Tuple[float, Dict[str, float]]:
+        '''Calculate the fuzzy value of the output parameter like calculate_result and return the cut
+        value of every output fuzzyset with it.'''
+        defuzzifier = self.get_defuzzifier(method)
+        timer = metrics.stage_timer()
+        memberships = self.compiled_rules.get_memberships(input_dict)
+        timer.lap('fuzzification')
+        strengths = self.compiled_rules.get_rule_strengths(memberships)
+        cut_values = self.compiled_rules.get_cut_values(strengths)
+        timer.lap('rule_evaluation')
+        result = self.__defuzzify(cut_values, defuzzifier)
+        timer.lap('defuzzification')
+        if metrics.enabled:
+            metrics.increment('fuzzy_evaluations_total')
+            metrics.count_rule_firings([strength > 0 for strength in strengths], self.rule_numbers)
+        return result, dict(zip(self.compiled_rules.consequents, cut_values))
+
+    def explain(self, input_dict: dict, method: str = None) -> InferenceTrace:
+        '''Calculate the fuzzy value of the output parameter like calculate_result and return
+        every intermediate value of the calculation with it.'''
+        defuzzifier = self.get_defuzzifier(method)
+        compiled_rules = self.compiled_rules
+        memberships = compiled_rules.get_memberships(input_dict)
+        strengths = compiled_rules.get_rule_strengths(memberships)
+        cut_values = compiled_rules.get_cut_values(strengths)
+        result = self.__defuzzify(cut_values, defuzzifier)
+        return InferenceTrace(
+            memberships=[TermTrace(term.parameter_name, term.fuzzyset_name, membership)
+                         for term, membership in zip(compiled_rules.terms, memberships)],
+            rules=[RuleTrace([compiled_rules.terms[i] for i in indices], rule.operator.name if rule.operator else None,
+                             str(rule.condition), compiled_rules.consequents[consequent], strength)
+                   for rule, indices, consequent, strength in zip(self.fuzzy_rules, compiled_rules.rule_terms,
+                                                                  compiled_rules.rule_consequents, strengths)],
+            cut_values=dict(zip(compiled_rules.consequents, cut_values)),
+            result=result,
+            status=self.get_health_status(result))
+
+    def __defuzzify(self, cut_values: List[float], defuzzifier: DefuzzificationMethod) -> float:
+        '''Defuzzify the cut values of the output fuzzy sets.'''
         # create deffuzification data
-        defuz_data = [FuzzySetDefuzData(self.output_param.sets[key], max_values[key]) for key in max_values.keys()]
+        defuz_data = [FuzzySetDefuzData(self.output_param.sets[key], cut_value)
+                      for key, cut_value in zip(self.compiled_rules.consequents, cut_values)]
         # calculate the output value
-        defuzz = CenterOfMassDefuz(stride=0.001, range=self.output_param.range)
-        return defuzz.defuzzify(defuz_data)
+        return defuzzifier.defuzzify(defuz_data)
+
+    def calculate_batch(self, inputs: Union[Dict[str, np.ndarray], np.ndarray], columns: List[str] = None,
+                        method: str = None) -> Tuple[np.ndarray, List[str]]:
+        '''Calculate the fuzzy value of the output parameter for a batch of inputs.
+        inputs is either a dictionary of 1-D arrays keyed by the parameter names in the rules,
+        or a 2-D array with one row per sample whose columns are named by the columns list.
+        method is the name of the defuzzification method like in calculate_result.
+        Returns the crisp values and their health status labels.
+        '''
+        results, statuses, _ = self.calculate_batch_and_cut_values(inputs, columns, method)
+        return results, statuses
+
+    def calculate_batch_and_cut_values(self, inputs: Union[Dict[str, np.ndarray], np.ndarray], columns: List[str] = None,
+                                       method: str = None) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        '''Calculate the fuzzy value of the output parameter for a batch of inputs like calculate_batch and
+        return the cut values with them, one row per sample and one column per consequent in compiled_rules.'''
+        defuzzifier = self.get_defuzzifier(method)
+        input_arrays = self.__get_input_arrays(inputs, columns)
+        fuzzy_sets = [self.output_param.sets[key] for key in self.compiled_rules.consequents]
+        timer = metrics.stage_timer()
+        memberships = self.compiled_rules.get_memberships_batch(input_arrays)
+        timer.lap('fuzzification')
+        strengths = self.compiled_rules.get_rule_strengths_batch(memberships)
+        cut_values = self.compiled_rules.get_cut_values_batch(strengths)
+        timer.lap('rule_evaluation')
+        results = defuzzifier.defuzzify_batch(fuzzy_sets, cut_values)
+        timer.lap('defuzzification')
+        if metrics.enabled:
+            metrics.increment('fuzzy_evaluations_total', len(results))
+            metrics.count_rule_firings((strengths > 0).sum(axis=1).tolist(), self.rule_numbers)
+        return results, [self.get_health_status(value) for value in results], cut_values
+
+    def calculate_records(self, records: List[dict], method: str = None) -> List[Tuple[float, str, str]]:
+        '''Calculate the fuzzy value of the output parameter for a list of input dictionaries in one batch.
+        returns (result, status, error) for every record, result and status are None for invalid records
+        and error is None for valid ones.'''
+        # an unknown method is an error of the call, not of every record
+        self.get_defuzzifier(method)
+        outputs = [None] * len(records)
+        valid_indices = []
+        columns = {name: [] for name in self.compiled_rules.parameter_names}
+        for i, record in enumerate(records):
+            try:
+                values = self.validate_input(record)
+            except ValueError as e:
+                outputs[i] = (None, None, str(e))
+                continue
+            valid_indices.append(i)
+            for name, value in values.items():
+                columns[name].append(value)
+        if valid_indices:
+            results, statuses = self.calculate_batch(columns, method=method)
+            for i, result, status in zip(valid_indices, results, statuses):
+                outputs[i] = (float(result), status, None)
+        return outputs
+
+    def sweep(self, input_dict: dict, sweep: Dict[str, List[float]], method: str = None) -> Tuple[np.ndarray, List[str]]:
+        '''Calculate the fuzzy value of the output parameter for an input dictionary while the swept
+        parameters take every combination of their values, the other inputs stay fixed. the swept
+        parameters can be missing from input_dict. Returns the crisp values in an array of shape
+        (len(values) for values in sweep.values()) and their health status labels in the same order
+        as the flattened array. raises ValueError like validate_input.'''
+        defuzzifier = self.get_defuzzifier(method)
+        if not sweep:
+            raise ValueError('At least one parameter must be swept')
+        sweep_values = dict()
+        for name, values in sweep.items():
+            if name not in self.compiled_rules.parameter_names:
+                raise ValueError(f'Parameter {name} is not used in the rules')
+            try:
+                values = np.asarray(values, dtype=float).reshape(-1)
+            except (TypeError, ValueError):
+                raise ValueError(f'Values of parameter {name} must be numbers') from None
+            if len(values) == 0:
+                raise ValueError(f'Parameter {name} has no values')
+            param_range = self.fuzzy_parameters[name].range
+            if not (param_range[0] <= values.min() and values.max() <= param_range[1]):
+                raise ValueError(f'Values of parameter {name} are out of range [{param_range[0]}, {param_range[1]}]')
+            sweep_values[name] = values
+        base = self.validate_input({**input_dict, **{name: values[0] for name, values in sweep_values.items()}})
+        grids = np.meshgrid(*sweep_values.values(), indexing='ij')
+        sweep_arrays = {name: grid.reshape(-1) for name, grid in zip(sweep_values, grids)}
+        fuzzy_sets = [self.output_param.sets[key] for key in self.compiled_rules.consequents]
+        # neighbouring points often fire the same rules equally, every distinct cut vector is defuzzified once
+        cut_values, inverse = np.unique(self.compiled_rules.evaluate_sweep(base, sweep_arrays), axis=0, return_inverse=True)
+        results = defuzzifier.defuzzify_batch(fuzzy_sets, cut_values)[inverse.reshape(-1)]
+        if metrics.enabled:
+            metrics.increment('fuzzy_evaluations_total', len(results))
+        return results.reshape(grids[0].shape), [self.get_health_status(value) for value in results]
+
+    @staticmethod
+    def __get_input_arrays(inputs: Union[Dict[str, np.ndarray], np.ndarray], columns: List[str]) -> Dict[str, np.ndarray]:
+        '''Convert the batch inputs to a dictionary of 1-D float arrays.'''
+        if isinstance(inputs, dict):
+            input_arrays = {name: np.asarray(values, dtype=float).reshape(-1) for name, values in inputs.items()}
+        else:
+            inputs = np.asarray(inputs, dtype=float)
+            if columns is None:
+                raise ValueError('columns must be given for a 2-D input array')
+            if inputs.ndim != 2 or inputs.shape[1] != len(columns):
+                raise ValueError('Input array must have one column per name in columns')
+            input_arrays = {name: inputs[:, i] for i, name in enumerate(columns)}
+        if len({len(values) for values in input_arrays.values()}) > 1:
+            raise ValueError('All input arrays must have the same length')
+        return input_arrays
 
     def get_health_status(self, value: float) -> str:
         status = ""
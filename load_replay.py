@@ -0,0 +1,378 @@
+'''Replay recorded or synthetic requests against a local server and report their latency.
+
+every line of a requests file is a JSON object. a recorded request has a path and a json or form
+body, e.g. {"path": "/api/explain?method=height", "json": {...}}, and any other object is a
+patient which is sent to --route. without a file, synthetic patients are generated like the
+benchmark's. the tool can start the server itself, once for every --server, so serving modes are
+compared on the same machine and the same requests. the default route /api/score scores one
+patient per request in every mode, and in the asgi mode it is the route which goes through the
+micro batcher; /api/results is served by every mode but never batched by the asgi app:
+
+    python3 load_replay.py --patients 2000 --concurrency 16 --server flask --server prefork:4 --server asgi
+    python3 load_replay.py recorded.jsonl --url http://127.0.0.1:8448 --rate 200 --output summary.json
+
+with a --rate the requests are sent on a fixed schedule and the latency of a request is counted
+from the time it was due, so a server which falls behind is not hidden by the clients waiting for it.
+'''
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode, urlsplit
+import numpy as np
+
+# command of every serving mode, {port} and {workers} are filled in
+SERVERS = {
+    'flask': ['-m', 'flask', 'run', '--port', '{port}', '--no-reload', '--no-debugger'],
+    'prefork': ['serve.py', '--port', '{port}', '--workers', '{workers}'],
+    'asgi': ['-m', 'uvicorn', 'asgi_app:app', '--port', '{port}', '--workers', '{workers}', '--log-level', 'warning'],
+}
+# environment variables of the serving modes, flask 2.0 finds the app by FLASK_APP and has no --app option
+SERVER_ENVIRONMENTS = {'flask': {'FLASK_APP': 'app'}}
+# modules of the serving modes which are not in requirements.txt
+SERVER_MODULES = {'asgi': 'uvicorn'}
+
+@dataclass
+class ReplayRequest:
+    '''A class to represent an HTTP request to replay.'''
+    method: str
+    path: str
+    body: bytes
+    content_type: str # None if there is no body
+
+@dataclass
+class ReplaySample:
+    '''A class to represent the response of a replayed request, status is 0 if there was no response.
+    records is the number of records scored by a JSON response and record_errors the number of them
+    which have an error, a JSON error of the whole request is one record.'''
+    path: str
+    status: int
+    latency: float
+    error: str = None
+    records: int = 0
+    record_errors: int = 0
+
+    @property
+    def failed(self) -> bool:
+        '''A request fails if it got no response, a status of 400 or more, or a record of it has an error.'''
+        return self.status == 0 or self.status >= 400 or self.record_errors > 0
+
+def build_request(path: str, body, form: bool = False, method: str = 'POST') -> ReplayRequest:
+    '''Returns a request with a JSON body, or a form body if form is True, and no body if body is None.'''
+    if body is None:
+        return ReplayRequest(method, path, None, None)
+    if form:
+        return ReplayRequest(method, path, urlencode({name: str(value) for name, value in body.items()}).encode(),
+                             'application/x-www-form-urlencoded')
+    return ReplayRequest(method, path, json.dumps(body).encode(), 'application/json')
+
+def patient_requests(patients: List[dict], route: str, batch_size: int = 1) -> List[ReplayRequest]:
+    '''Returns the requests which send patients to a route. /result gets one form per patient,
+    /api/results gets arrays of batch_size patients and the other routes one JSON object per patient.'''
+    route_path = urlsplit(route).path
+    if route_path == '/api/results':
+        return [build_request(route, patients[start:start + batch_size]) for start in range(0, len(patients), batch_size)]
+    return [build_request(route, patient, form=route_path == '/result') for patient in patients]
+
+def read_requests(file, route: str, batch_size: int = 1) -> List[ReplayRequest]:
+    '''Read the requests of a JSONL file, objects without a path are patients sent to route.'''
+    requests, patients = [], []
+    for line_number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f'line {line_number}: {e}') from None
+        if not isinstance(record, dict):
+            raise ValueError(f'line {line_number}: a request must be a JSON object')
+        if 'path' not in record:
+            patients.append(record)
+        elif 'form' in record:
+            requests.append(build_request(record['path'], record['form'], form=True, method=record.get('method', 'POST')))
+        else:
+            requests.append(build_request(record['path'], record.get('json'), method=record.get('method', 'POST')))
+    return requests + patient_requests(patients, route, batch_size)
+
+class LoadReplayer:
+    '''A class to send requests to a server from concurrency threads, each with its own keep-alive
+    connection. the requests are sent in order and repeated until count requests were sent. with a
+    rate the i-th request is due i / rate seconds after the start, otherwise every thread sends its
+    next request as soon as it has the response of the last one.'''
+
+    def __init__(self, host: str, port: int, requests: List[ReplayRequest], concurrency: int = 8,
+                 rate: float = None, count: int = None, timeout: float = 30) -> None:
+        if not requests:
+            raise ValueError('There are no requests to replay')
+        self.host = host
+        self.port = port
+        self.requests = requests
+        self.concurrency = concurrency
+        self.rate = rate
+        self.count = count if count is not None else len(requests)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.samples = [] # type: List[ReplaySample]
+        self.start = None
+
+    def run(self) -> Tuple[List[ReplaySample], float]:
+        '''Replay the requests, returns the samples and the duration of the run in seconds.'''
+        self.next_index = 0
+        self.samples = []
+        self.start = time.perf_counter()
+        threads = [threading.Thread(target=self.__worker, daemon=True) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.samples, time.perf_counter() - self.start
+
+    def __take(self) -> int:
+        with self.lock:
+            index = self.next_index
+            self.next_index += 1
+        return index if index < self.count else None
+
+    def __worker(self) -> None:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        samples = []
+        index = self.__take()
+        while index is not None:
+            request = self.requests[index % len(self.requests)]
+            start = time.perf_counter()
+            if self.rate:
+                due = self.start + index / self.rate
+                if due > start:
+                    time.sleep(due - start)
+                start = due
+            status, error, body, content_type = 0, None, b'', ''
+            try:
+                headers = {'Content-Type': request.content_type} if request.content_type else dict()
+                connection.request(request.method, request.path, body=request.body, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                status = response.status
+                content_type = response.getheader('Content-Type', '')
+                if response.will_close:
+                    connection.close()
+            except (OSError, http.client.HTTPException) as e:
+                error = f'{type(e).__name__}: {e}'
+                # the connection is opened again by the next request
+                connection.close()
+            sample = ReplaySample(request.path, status, time.perf_counter() - start, error)
+            # the body is checked after the latency is taken
+            if content_type.startswith('application/json'):
+                sample.records, sample.record_errors, sample.error = count_records(body, sample.error)
+            samples.append(sample)
+            index = self.__take()
+        connection.close()
+        with self.lock:
+            self.samples.extend(samples)
+
+def count_records(body: bytes, error: str = None) -> Tuple[int, int, str]:
+    '''Count the records of a JSON response and the records with an error. an array has one output per
+    record and an object is one output. returns the counts and the error message, which is the first
+    record error if there was no other error.'''
+    try:
+        outputs = json.loads(body)
+    except ValueError:
+        return 0, 0, error or 'response is not valid JSON'
+    if not isinstance(outputs, list):
+        outputs = [outputs]
+    errors = [output['error'] for output in outputs if isinstance(output, dict) and 'error' in output]
+    return len(outputs), len(errors), error or (str(errors[0]) if errors else None)
+
+def get_percentiles(latencies: List[float]) -> Dict[str, float]:
+    latencies = np.array(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+        'max_ms': float(latencies.max()),
+    }
+
+def summarize(samples: List[ReplaySample], duration: float) -> dict:
+    '''Returns the latency percentiles, throughput and error rate of a run, in total and by route.
+    a request is an error if it failed, and the records of the JSON responses are counted too, so
+    an /api/results request whose records all have errors is as many record errors.'''
+    summary = {
+        'requests': len(samples),
+        'errors': sum(sample.failed for sample in samples),
+        'records': sum(sample.records for sample in samples),
+        'record_errors': sum(sample.record_errors for sample in samples),
+        'duration_sec': duration,
+        'throughput_per_sec': len(samples) / duration if duration else 0,
+    }
+    summary['error_rate'] = summary['errors'] / len(samples) if samples else 0
+    summary['record_error_rate'] = summary['record_errors'] / summary['records'] if summary['records'] else 0
+    if samples:
+        summary.update(get_percentiles([sample.latency for sample in samples]))
+    statuses = dict()
+    for sample in samples:
+        statuses[str(sample.status)] = statuses.get(str(sample.status), 0) + 1
+    summary['statuses'] = statuses
+    routes = dict()
+    for sample in samples:
+        routes.setdefault(urlsplit(sample.path).path, []).append(sample)
+    summary['routes'] = {path: {'requests': len(route_samples), 'errors': sum(sample.failed for sample in route_samples),
+                                'record_errors': sum(sample.record_errors for sample in route_samples),
+                                **get_percentiles([sample.latency for sample in route_samples])}
+                         for path, route_samples in routes.items()}
+    # the first errors tell why requests failed
+    summary['error_messages'] = sorted({sample.error for sample in samples if sample.error})[:10]
+    return summary
+
+def get_missing_module(mode: str) -> str:
+    '''Returns the module which the serving mode needs and which is not installed, None if there is none.'''
+    module = SERVER_MODULES.get(mode)
+    return module if module and importlib.util.find_spec(module) is None else None
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class LocalServer:
+    '''A class to run a serving mode of the app in a child process while it is used as a context
+    manager. mode is flask, prefork or asgi, workers is ignored by the single process flask server.'''
+
+    def __init__(self, mode: str, workers: int = None, start_timeout: float = 60) -> None:
+        if mode not in SERVERS:
+            raise ValueError(f'Unknown server {mode!r}, it must be one of {", ".join(SERVERS)}')
+        module = get_missing_module(mode)
+        if module:
+            raise RuntimeError(f'The {mode} server needs {module}, install it with pip install {module}')
+        self.mode = mode
+        self.workers = workers or os.cpu_count()
+        self.start_timeout = start_timeout
+        self.port = get_free_port()
+        self.process = None
+        self.log = None
+
+    def __enter__(self) -> 'LocalServer':
+        command = [sys.executable] + [part.format(port=self.port, workers=self.workers) for part in SERVERS[self.mode]]
+        self.log = tempfile.TemporaryFile()
+        # the servers find the rules file and the templates relative to the repository
+        self.process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        env=dict(os.environ, **SERVER_ENVIRONMENTS.get(self.mode, dict())),
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                output = self.log.read().decode(errors='replace')[-2000:]
+                self.__exit__(None, None, None)
+                raise RuntimeError(f'{self.mode} server exited with code {self.process.returncode}:\n{output}')
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f'{self.mode} server did not start in {self.start_timeout} seconds')
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self.process is not None and self.process.poll() is None:
+            # SIGTERM lets the pre-forked workers finish their requests
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.log is not None:
+            self.log.close()
+
+def replay(host: str, port: int, requests: List[ReplayRequest], args: argparse.Namespace) -> dict:
+    '''Send the warm up requests, then replay the requests and return the summary of the run.'''
+    if args.warmup:
+        LoadReplayer(host, port, requests, args.concurrency, count=args.warmup, timeout=args.timeout).run()
+    samples, duration = LoadReplayer(host, port, requests, args.concurrency, args.rate, args.requests, args.timeout).run()
+    return summarize(samples, duration)
+
+def print_summary(name: str, summary: dict) -> None:
+    print(f'{name}: {summary["requests"]} requests in {summary["duration_sec"]:.2f} s, '
+          f'{summary["throughput_per_sec"]:.0f} requests/s, error rate {summary["error_rate"] * 100:.2f}%, '
+          f'record error rate {summary["record_error_rate"] * 100:.2f}% of {summary["records"]} records')
+    if summary['requests']:
+        print(f'    {"route":<32}{"requests":>10}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+        for path, route in summary['routes'].items():
+            print(f'    {path:<32}{route["requests"]:>10}{route["errors"]:>8}'
+                  f'{route["p50_ms"]:>10.2f}{route["p95_ms"]:>10.2f}{route["p99_ms"]:>10.2f}')
+        print(f'    {"all":<32}{summary["requests"]:>10}{summary["errors"]:>8}'
+              f'{summary["p50_ms"]:>10.2f}{summary["p95_ms"]:>10.2f}{summary["p99_ms"]:>10.2f}')
+    for message in summary['error_messages']:
+        print(f'    {message}')
+
+def parse_server(text: str) -> Tuple[str, int]:
+    '''Parse a serving mode written like "prefork:4", the number of workers is optional.'''
+    mode, _, workers = text.partition(':')
+    return mode, int(workers) if workers else None
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description='Replay requests against the web app and report their latency.')
+    parser.add_argument('input', nargs='?', help='JSONL file of requests or patients, - for stdin (default: synthetic patients)')
+    parser.add_argument('--patients', type=int, default=1000, help='number of synthetic patients (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic patients (default: 0)')
+    parser.add_argument('--route', default='/api/score',
+                        help='route the patients are sent to, with an optional query like ?method=height; /api/score is served by '
+                             'every mode and micro batched by asgi, /api/results is never batched by asgi (default: /api/score)')
+    parser.add_argument('--batch-size', type=int, default=1, help='patients in one /api/results request (default: 1)')
+    parser.add_argument('--requests', type=int, help='number of requests to send, the input is repeated (default: one pass)')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent clients (default: 8)')
+    parser.add_argument('--rate', type=float, help='target requests per second (default: as fast as the server answers)')
+    parser.add_argument('--warmup', type=int, default=0, help='requests sent before the measured run (default: 0)')
+    parser.add_argument('--timeout', type=float, default=30, help='timeout of a request in seconds (default: 30)')
+    parser.add_argument('--url', help='URL of a running server, e.g. http://127.0.0.1:8448')
+    parser.add_argument('--server', action='append', default=[], metavar='MODE[:WORKERS]',
+                        help=f'start a local server and replay against it, one of {", ".join(SERVERS)}; can be given more than once')
+    parser.add_argument('--output', help='save the summary to this JSON file')
+    args = parser.parse_args(argv)
+    if bool(args.url) == bool(args.server):
+        parser.error('give either --url or at least one --server')
+    for server in args.server:
+        mode = parse_server(server)[0]
+        if mode not in SERVERS:
+            parser.error(f'unknown server {server!r}, it must be one of {", ".join(SERVERS)}')
+        module = get_missing_module(mode)
+        if module:
+            parser.error(f'the {mode} server needs {module}, install it with pip install {module}')
+    if args.input:
+        input_file = sys.stdin if args.input == '-' else open(args.input)
+        try:
+            requests = read_requests(input_file, args.route, args.batch_size)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+    else:
+        from benchmark import generate_patients
+        requests = patient_requests(generate_patients(args.patients, args.seed), args.route, args.batch_size)
+    runs = dict()
+    if args.url:
+        url = urlsplit(args.url)
+        runs[args.url] = replay(url.hostname, url.port or 80, requests, args)
+        print_summary(args.url, runs[args.url])
+    for server in args.server:
+        mode, workers = parse_server(server)
+        with LocalServer(mode, workers) as local_server:
+            runs[server] = replay('127.0.0.1', local_server.port, requests, args)
+        print_summary(server, runs[server])
+    if args.output:
+        config = {name: value for name, value in vars(args).items() if name != 'output'}
+        with open(args.output, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': config, 'runs': runs}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
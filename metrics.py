@@ -0,0 +1,247 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import List, Tuple
+from files import atomic_write
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+# file of a shared directory with the added up values of the processes which exited
+RETIRED_FILE = 'retired.json'
+
+class Histogram:
+    '''A class to count observed values in buckets, like a prometheus histogram.'''
+
+    def __init__(self, buckets: Tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class StageTimer:
+    '''A class to record the durations of the consecutive stages of one calculation, every lap
+    records the time since the previous one. a timer of disabled metrics records nothing.'''
+
+    def __init__(self, metrics: 'Metrics') -> None:
+        self.metrics = metrics
+        self.last = time.perf_counter() if metrics.enabled else None
+
+    def lap(self, stage: str) -> None:
+        '''Record the duration of the stage which ended now.'''
+        if self.last is None:
+            return
+        now = time.perf_counter()
+        self.metrics.observe_stage(stage, now - self.last)
+        self.last = now
+
+class Metrics:
+    '''A class to collect counters and latency histograms of the fuzzy system and export them in
+    the prometheus text format. nothing is recorded while it is disabled, so callers check
+    enabled before they measure anything, a stage_timer checks it itself.
+
+    processes which serve the same app, like the pre-forked workers, share a directory: every
+    process saves its values to its own file in it, and export adds up the files of every process,
+    so a scrape gets the totals whichever process answers it. the values of processes which exited
+    are added to one retired file by retire_process, so the counters never go back and the
+    directory keeps one file per running process.'''
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.directory = None
+        self.file_name = None
+        self.flush_thread = None
+        self.descriptions = dict() # name -> (type, help text)
+        self.counters = dict() # name -> labels -> value
+        self.histograms = dict() # name -> labels -> Histogram
+        self.describe('fuzzy_stage_duration_seconds', 'histogram', 'Duration of each stage of the inference pipeline.')
+        self.describe('fuzzy_request_duration_seconds', 'histogram', 'Duration of the HTTP requests.')
+        self.describe('fuzzy_requests_total', 'counter', 'Number of HTTP requests.')
+        self.describe('fuzzy_request_errors_total', 'counter', 'Number of HTTP requests which failed.')
+        self.describe('fuzzy_evaluations_total', 'counter', 'Number of inputs scored by the fuzzy system.')
+        self.describe('fuzzy_rule_firings_total', 'counter', 'Number of times each rule fired with a strength above 0.')
+
+    def describe(self, name: str, metric_type: str, description: str) -> None:
+        '''Register the type and help text of a metric.'''
+        self.descriptions[name] = (metric_type, description)
+        if metric_type == 'histogram':
+            self.histograms.setdefault(name, dict())
+        else:
+            self.counters.setdefault(name, dict())
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        '''Add value to a counter.'''
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counter = self.counters[name]
+            counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        '''Add an observed value to a histogram.'''
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histograms = self.histograms[name]
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].observe(value)
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        '''Add the duration of a pipeline stage.'''
+        self.observe('fuzzy_stage_duration_seconds', seconds, stage=stage)
+
+    def stage_timer(self) -> StageTimer:
+        '''Returns a timer which records the stages of one calculation.'''
+        return StageTimer(self)
+
+    def count_rule_firings(self, counts: List[int], numbers: List[int] = None) -> None:
+        '''Add the number of firings of every rule, counts[i] belongs to the rule numbers[i],
+        or to the (i + 1)th rule without numbers.'''
+        with self.lock:
+            counter = self.counters['fuzzy_rule_firings_total']
+            for i, count in enumerate(counts):
+                if count:
+                    key = (('rule', str(numbers[i] if numbers else i + 1)),)
+                    counter[key] = counter.get(key, 0) + count
+
+    def reset(self) -> None:
+        '''Remove every recorded value.'''
+        with self.lock:
+            for values in list(self.counters.values()) + list(self.histograms.values()):
+                values.clear()
+
+    def share(self, directory: str, flush_interval: float = 1) -> None:
+        '''Save the values of this process to a file in directory every flush_interval seconds and
+        export the values of every process which shares it. a forked process calls it again to get
+        its own file, the values it inherited are removed first.'''
+        self.reset()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # the start time tells apart two processes which got the same pid
+        self.file_name = os.path.join(directory, f'{os.getpid()}-{time.time_ns()}.json')
+        self.flush()
+        thread = threading.Thread(target=self.__flush_periodically, args=(self.file_name, flush_interval), daemon=True)
+        thread.start()
+        self.flush_thread = thread
+
+    def __flush_periodically(self, file_name: str, interval: float) -> None:
+        # stop when share is called again with another file
+        while self.file_name == file_name:
+            time.sleep(interval)
+            self.flush()
+
+    def flush(self) -> None:
+        '''Save the values of this process to its file in the shared directory.'''
+        if self.file_name is None:
+            return
+        snapshot = json.dumps(self.snapshot())
+        with atomic_write(self.file_name) as f:
+            f.write(snapshot)
+
+    def snapshot(self) -> dict:
+        '''Returns the recorded values as plain data.'''
+        with self.lock:
+            return {
+                'counters': {name: [[list(key), value] for key, value in values.items()] for name, values in self.counters.items()},
+                'histograms': {name: [[list(key), histogram.counts, histogram.sum, histogram.count]
+                                      for key, histogram in values.items()] for name, values in self.histograms.items()},
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        '''Add the values of a snapshot to the recorded values.'''
+        with self.lock:
+            for name, values in snapshot['counters'].items():
+                counter = self.counters.setdefault(name, dict())
+                for key, value in values:
+                    key = tuple(tuple(label) for label in key)
+                    counter[key] = counter.get(key, 0) + value
+            for name, values in snapshot['histograms'].items():
+                histograms = self.histograms.setdefault(name, dict())
+                for key, counts, total, count in values:
+                    key = tuple(tuple(label) for label in key)
+                    histogram = histograms.setdefault(key, Histogram())
+                    histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                    histogram.sum += total
+                    histogram.count += count
+
+    def export(self) -> str:
+        '''Returns the metrics in the prometheus text format, added up over every process of the
+        shared directory if there is one.'''
+        if self.directory is None:
+            return self.__format()
+        self.flush()
+        total = Metrics()
+        total.descriptions.update(self.descriptions)
+        # a process which is being retired is counted either in its own file or in the retired file
+        with lock_directory(self.directory, fcntl.LOCK_SH):
+            total.merge_files(glob.glob(os.path.join(self.directory, '*.json')))
+        return total.__format()
+
+    def merge_files(self, file_names: List[str]) -> None:
+        '''Add the values of the snapshots saved in the files, files which do not exist are skipped.'''
+        for file_name in sorted(file_names):
+            try:
+                with open(file_name) as f:
+                    self.merge(json.load(f))
+            except FileNotFoundError:
+                continue
+
+    def __format(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (metric_type, description) in self.descriptions.items():
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                if metric_type == 'histogram':
+                    for key, histogram in self.histograms.get(name, dict()).items():
+                        cumulative = 0
+                        for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                            cumulative += count
+                            lines.append(f'{name}_bucket{format_labels(key + (("le", str(bound)),))} {cumulative}')
+                        lines.append(f'{name}_sum{format_labels(key)} {histogram.sum}')
+                        lines.append(f'{name}_count{format_labels(key)} {histogram.count}')
+                else:
+                    for key, value in self.counters.get(name, dict()).items():
+                        lines.append(f'{name}{format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+@contextmanager
+def lock_directory(directory: str, operation: int):
+    '''Hold a shared (fcntl.LOCK_SH) or exclusive (fcntl.LOCK_EX) lock of a shared directory.'''
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        fcntl.flock(f, operation)
+        yield
+
+def retire_process(directory: str, pid: int) -> None:
+    '''Add the values of a process which exited to the retired file of a shared directory and remove
+    the file of the process.'''
+    file_names = glob.glob(os.path.join(directory, f'{pid}-*.json'))
+    if not file_names:
+        return
+    retired_file = os.path.join(directory, RETIRED_FILE)
+    with lock_directory(directory, fcntl.LOCK_EX):
+        retired = Metrics()
+        retired.merge_files([retired_file] + file_names)
+        with atomic_write(retired_file) as f:
+            json.dump(retired.snapshot(), f)
+        for file_name in file_names:
+            os.remove(file_name)
+
+def format_labels(labels: Tuple) -> str:
+    '''Format label pairs like {name="value",...}.'''
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+# metrics of the whole process, disabled unless FUZZY_METRICS=1 or a caller enables them
+metrics = Metrics(enabled=os.environ.get('FUZZY_METRICS', '0') == '1')
@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+class QueueFullError(RuntimeError):
+    '''Raised when a record is sent to a micro batcher whose queue is full.'''
+    pass
+
+class MicroBatcher:
+    '''A class to collect scoring requests of concurrent callers and score them together.
+    a batch is scored as soon as it has max_batch_size records or its first record has waited
+    max_wait seconds. while the queue holds max_queue_size records new records are rejected,
+    so an overloaded server sheds load instead of keeping callers waiting.'''
+
+    def __init__(self, score_batch: Callable[[List[dict]], list], max_batch_size: int = 64,
+                 max_wait: float = 0.002, max_queue_size: int = 4096) -> None:
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self.queue = None
+        self.task = None
+        # one thread, so batches are scored one after another while the event loop keeps collecting
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='micro-batcher')
+
+    @property
+    def started(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def start(self) -> None:
+        '''Start collecting batches in the running event loop.'''
+        if not self.started:
+            self.queue = asyncio.Queue(self.max_queue_size)
+            self.task = asyncio.get_running_loop().create_task(self.__run())
+
+    async def stop(self) -> None:
+        '''Stop collecting batches and fail the requests which are still in the queue.'''
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.queue is not None and not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError('Micro batcher stopped'))
+
+    async def score(self, record: dict):
+        '''Score one record in the next batch and return its output. raises QueueFullError if the queue is full.'''
+        if not self.started:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((record, future))
+        except asyncio.QueueFull:
+            raise QueueFullError(f'Micro batcher queue is full with {self.max_queue_size} records') from None
+        return await future
+
+    async def __collect(self) -> list:
+        '''Wait for the first request, then collect requests until the batch is full or the time is up.'''
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.__collect()
+            # callers which gave up while waiting do not need a result
+            batch = [(record, future) for record, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                outputs = await loop.run_in_executor(self.executor, self.score_batch, [record for record, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
@@ -0,0 +1,76 @@
+'''A cache of the parsed rules and the membership breakpoints of the fuzzy system on disk.
+
+the model of a rules file is saved as JSON next to it, e.g. rules.fcl.model, so it is only
+writable by whoever can change the rules. it is loaded instead of parsing the rules and building
+the fuzzysets while it is fresh. a model is fresh when its format version and its hash of the
+rules file and of the modules which define the fuzzysets and the rule syntax are the current ones.
+'''
+import hashlib
+import json
+from typing import List, Tuple
+import fuzzification
+import rule_parser
+from files import atomic_write
+from fuzzification import FuzzyParameter
+from rule_parser import Expression, OperatorExpression, TermExpression
+
+FORMAT_VERSION = 1
+
+ParsedRule = Tuple[int, Expression, Tuple[str, str]]
+
+def get_model_path(rules_file: str) -> str:
+    '''Returns the path of the saved model of a rules file.'''
+    return rules_file + '.model'
+
+def get_source_hash(rules_file: str) -> str:
+    '''Returns a hash of the rules file and of the sources of the fuzzysets and the rule parser.'''
+    digest = hashlib.sha256(str(FORMAT_VERSION).encode())
+    for path in (rules_file, fuzzification.__file__, rule_parser.__file__):
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def load_model(rules_file: str) -> Tuple[List[ParsedRule], List[FuzzyParameter], FuzzyParameter]:
+    '''Returns the parsed rules, the fuzzy parameters and the output parameter saved for a rules
+    file, None if there is no saved model or it is stale or unreadable.'''
+    try:
+        with open(get_model_path(rules_file)) as f:
+            model = json.load(f)
+        if model.get('version') != FORMAT_VERSION or model.get('hash') != get_source_hash(rules_file):
+            return None
+        rules = [(line_number, expression_from_data(condition), tuple(then_clause))
+                 for line_number, condition, then_clause in model['rules']]
+        output_param = FuzzyParameter.from_definition(model['output'])
+        # like init_output_fuzzy_sets, so the approximate defuzzification methods do not calculate them in a request
+        output_param.get_moments()
+        return rules, [FuzzyParameter.from_definition(definition) for definition in model['parameters']], output_param
+    except (OSError, ValueError, KeyError, TypeError, IndexError):
+        return None
+
+def save_model(rules_file: str, rules: List[ParsedRule], fuzzy_parameters: List[FuzzyParameter],
+               output_param: FuzzyParameter) -> bool:
+    '''Save the model of a rules file next to it, returns False if it can not be written.'''
+    model = {
+        'version': FORMAT_VERSION,
+        'hash': get_source_hash(rules_file),
+        'rules': [[line_number, expression_to_data(condition), list(then_clause)] for line_number, condition, then_clause in rules],
+        'parameters': [param.get_definition() for param in fuzzy_parameters],
+        'output': output_param.get_definition(),
+    }
+    try:
+        with atomic_write(get_model_path(rules_file)) as f:
+            json.dump(model, f)
+        return True
+    except OSError:
+        return False
+
+def expression_to_data(expression: Expression) -> list:
+    '''Returns a condition as nested lists, ['IS', parameter, fuzzyset] or [operator, operands...].'''
+    if isinstance(expression, TermExpression):
+        return ['IS', expression.parameter_name, expression.fuzzyset_name]
+    return [expression.operator] + [expression_to_data(operand) for operand in expression.operands]
+
+def expression_from_data(data: list) -> Expression:
+    if data[0] == 'IS':
+        return TermExpression(data[1], data[2])
+    return OperatorExpression(data[0], tuple(expression_from_data(operand) for operand in data[1:]))
@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from inference import FuzzyIntelligentSystem
+from metrics import metrics
+
+metrics.describe('fuzzy_cache_hits_total', 'counter', 'Number of results found in the result cache.')
+metrics.describe('fuzzy_cache_misses_total', 'counter', 'Number of results which were not in the result cache.')
+
+class ResultCache:
+    '''A class to cache the results of the fuzzy system by their input vector.
+
+    the key of an input is the name of the defuzzification method and the values of the parameters
+    used by the rules, each one rounded to the resolution of its parameter, and the fuzzy system
+    scores the rounded values so every input of a key gets the same result. the cut values of the output fuzzysets are
+    kept with the result, so they need no second evaluation. entries are evicted in least recently used order
+    when there are more than max_entries, and after ttl seconds if ttl is given. the cache is bounded by its
+    number of entries only, an entry of the rules.fcl inputs takes about 0.6 KB, so 10000 take about 6 MB.
+    with a db_path the entries are also kept in a SQLite file, so processes using the same file share them.
+    the cache is cleared whenever the fingerprint of the fuzzy system changes.'''
+
+    def __init__(self, max_entries: int = 10000, resolutions: Dict[str, float] = None,
+                 ttl: float = None, db_path: str = None) -> None:
+        self.max_entries = max_entries
+        self.resolutions = resolutions or dict()
+        self.ttl = ttl
+        self.db_path = db_path
+        self.entries = OrderedDict() # key -> (result, status, cut values, created time)
+        self.lock = threading.Lock()
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+        self.connection_pid = None
+
+    def get_result(self, fuzzy_system: FuzzyIntelligentSystem, input_dict: dict, method: str = None) -> Tuple[float, str]:
+        '''Returns the result and the status of an input dictionary, defuzzified with the method of the given name.
+        raises ValueError if an input is missing, is not a number or is out of range.'''
+        result, status, error = self.get_results(fuzzy_system, [input_dict], method)[0]
+        if error is not None:
+            raise ValueError(error)
+        return result, status
+
+    def get_result_and_cut_values(self, fuzzy_system: FuzzyIntelligentSystem, input_dict: dict,
+                                  method: str = None) -> Tuple[float, str, Dict[str, float]]:
+        '''Returns the result and the status of an input dictionary like get_result, and the cut value of every output fuzzyset.'''
+        result, status, cut_values, error = self.get_results_and_cut_values(fuzzy_system, [input_dict], method)[0]
+        if error is not None:
+            raise ValueError(error)
+        return result, status, cut_values
+
+    def get_results(self, fuzzy_system: FuzzyIntelligentSystem, records: List[dict], method: str = None) -> List[Tuple[float, str, str]]:
+        '''Returns (result, status, error) for every record like FuzzyIntelligentSystem.calculate_records,
+        the records which are not in the cache are scored in one batch.'''
+        return [(result, status, error) for result, status, _, error in self.get_results_and_cut_values(fuzzy_system, records, method)]
+
+    def get_results_and_cut_values(self, fuzzy_system: FuzzyIntelligentSystem, records: List[dict],
+                                   method: str = None) -> List[Tuple[float, str, Dict[str, float], str]]:
+        '''Returns (result, status, cut values, error) for every record, like get_results with the cut value
+        of every output fuzzyset, which is None for invalid records.'''
+        self.__check_fingerprint(fuzzy_system)
+        # cached records are not scored, so the method is checked here even if every record is a hit
+        fuzzy_system.get_defuzzifier(method)
+        consequents = fuzzy_system.compiled_rules.consequents
+        outputs = [None] * len(records)
+        missing = dict() # key -> indices of the records with this key
+        hits, misses = 0, 0
+        for i, record in enumerate(records):
+            try:
+                # results of different defuzzification methods are different entries
+                key = (method,) + self.get_key(fuzzy_system, record)
+            except ValueError as e:
+                outputs[i] = (None, None, None, str(e))
+                continue
+            cached = self.__get(key) if key not in missing else None
+            if cached is not None:
+                outputs[i] = (cached[0], cached[1], dict(zip(consequents, cached[2])), None)
+                hits += 1
+            else:
+                missing.setdefault(key, []).append(i)
+                misses += 1
+        self.__count(hits, misses)
+        if missing:
+            keys = list(missing)
+            names = fuzzy_system.compiled_rules.parameter_names
+            if len(keys) == 1:
+                # a single input is faster on the scalar path
+                result, cut_values = fuzzy_system.calculate_result_and_cut_values(dict(zip(names, keys[0][1:])), method)
+                results, statuses = [result], [fuzzy_system.get_health_status(result)]
+                cut_rows = [[cut_values[name] for name in consequents]]
+            else:
+                results, statuses, cut_rows = fuzzy_system.calculate_batch_and_cut_values(
+                    {name: [key[j + 1] for key in keys] for j, name in enumerate(names)}, method=method)
+            new_entries = []
+            for key, result, status, cut_row in zip(keys, results, statuses, cut_rows):
+                cut_row = tuple(float(cut_value) for cut_value in cut_row)
+                new_entries.append((key, float(result), status, cut_row))
+                for i in missing[key]:
+                    outputs[i] = (float(result), status, dict(zip(consequents, cut_row)), None)
+            self.__put(new_entries, fuzzy_system.fingerprint)
+        return outputs
+
+    def get_key(self, fuzzy_system: FuzzyIntelligentSystem, input_dict: dict) -> Tuple[float, ...]:
+        '''Returns the rounded values of the parameters used by the rules.'''
+        values = fuzzy_system.validate_input(input_dict)
+        key = []
+        for name, value in values.items():
+            resolution = self.resolutions.get(name)
+            if resolution:
+                low, high = fuzzy_system.fuzzy_parameters[name].range
+                value = min(max(round(value / resolution) * resolution, low), high)
+            key.append(float(value))
+        return tuple(key)
+
+    def clear(self) -> None:
+        '''Remove every entry of the cache.'''
+        with self.lock:
+            self.entries.clear()
+            connection = self.__get_connection()
+            if connection is not None:
+                connection.execute('DELETE FROM results')
+                connection.commit()
+
+    def __check_fingerprint(self, fuzzy_system: FuzzyIntelligentSystem) -> None:
+        # the results of another rulebase or other fuzzysets are not valid any more
+        if fuzzy_system.fingerprint != self.fingerprint:
+            with self.lock:
+                self.entries.clear()
+                self.fingerprint = fuzzy_system.fingerprint
+                connection = self.__get_connection()
+                if connection is not None:
+                    connection.execute('DELETE FROM results WHERE fingerprint != ?', (self.fingerprint,))
+                    connection.commit()
+
+    def __count(self, hits: int, misses: int) -> None:
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+        if metrics.enabled:
+            metrics.increment('fuzzy_cache_hits_total', hits)
+            metrics.increment('fuzzy_cache_misses_total', misses)
+
+    def __expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def __get(self, key: Tuple[float, ...]) -> Tuple[float, str, Tuple[float, ...]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if not self.__expired(entry[3]):
+                    self.entries.move_to_end(key)
+                    return entry[:3]
+                del self.entries[key]
+            connection = self.__get_connection()
+            if connection is None:
+                return None
+            row = connection.execute('SELECT result, status, cut_values, created FROM results WHERE fingerprint = ? AND key = ?',
+                                     (self.fingerprint, json.dumps(key))).fetchone()
+            if row is None or self.__expired(row[3]):
+                return None
+            cut_values = tuple(json.loads(row[2]))
+            self.__store(key, row[0], row[1], cut_values, row[3])
+            return row[0], row[1], cut_values
+
+    def __put(self, entries: List[Tuple[Tuple[float, ...], float, str, Tuple[float, ...]]], fingerprint: str) -> None:
+        created = time.time()
+        with self.lock:
+            # the fuzzy system was reloaded while these results were calculated
+            if fingerprint != self.fingerprint:
+                return
+            for key, result, status, cut_values in entries:
+                self.__store(key, result, status, cut_values, created)
+            connection = self.__get_connection()
+            if connection is not None:
+                connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                                       [(self.fingerprint, json.dumps(key), result, status, json.dumps(cut_values), created)
+                                        for key, result, status, cut_values in entries])
+                connection.commit()
+
+    def __store(self, key: Tuple[float, ...], result: float, status: str, cut_values: Tuple[float, ...], created: float) -> None:
+        self.entries[key] = (result, status, cut_values, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __get_connection(self) -> sqlite3.Connection:
+        '''Returns the SQLite connection of the current process, None if there is no db_path.'''
+        if self.db_path is None:
+            return None
+        # a connection can not be used after a fork, every process opens its own
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(results)')]
+            if columns and 'cut_values' not in columns:
+                # a file written before the cut values were cached, its entries are only a cache
+                self.connection.execute('DROP TABLE results')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results (fingerprint TEXT, key TEXT, result REAL, '
+                                    'status TEXT, cut_values TEXT, created REAL, PRIMARY KEY (fingerprint, key))')
+            self.connection_pid = os.getpid()
+        return self.connection
+
+def parse_resolutions(text: str) -> Dict[str, float]:
+    '''Parse resolutions written like "age=1,cholesterol=5".'''
+    resolutions = dict()
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, value = item.split('=')
+        resolutions[name.strip()] = float(value)
+    return resolutions
@@ -0,0 +1,190 @@
+'''A static analysis of a rulebase which finds the rules that can not change the result.
+
+the cut value of a consequent is the max of the strengths of its rules, so a rule whose strength
+is never above the strength of another rule with the same consequent adds nothing. the analysis
+removes rules with the same condition as an earlier rule (duplicates) and rules whose condition
+is never stronger than the condition of another rule (subsumed), e.g.
+
+    IF (age IS old) AND (sex IS male) THEN health IS sick_2     is subsumed by
+    IF (age IS old) THEN health IS sick_2
+
+it also reports rules which use undefined parameters or fuzzysets, they fail on every input.
+
+    python3 rule_analysis.py rules.fcl --output optimized.fcl
+'''
+import argparse
+import json
+import sys
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
+from fuzzification import FuzzyParameter, init_fuzzy_parameters, init_output_fuzzy_sets
+from rule_parser import Expression, OperatorExpression, RuleParser
+
+@dataclass
+class RuleFinding:
+    '''A class to represent a rule reported by the analysis. kind is duplicate, subsumed or undefined,
+    index is the position of the rule in the analyzed list and kept_by the position of the rule
+    which makes it redundant.'''
+    kind: str
+    index: int
+    line_number: int
+    rule: str
+    reason: str
+    kept_by: int = None
+
+@dataclass
+class RulebaseReport:
+    '''A class to represent the result of the analysis, kept are the positions of the rules of the optimized rulebase.'''
+    rule_count: int
+    kept: List[int]
+    findings: List[RuleFinding]
+
+    @property
+    def removed(self) -> List[RuleFinding]:
+        return [finding for finding in self.findings if finding.kind != 'undefined']
+
+    @property
+    def undefined(self) -> List[RuleFinding]:
+        return [finding for finding in self.findings if finding.kind == 'undefined']
+
+class RulebaseAnalyzer:
+    '''A class to find duplicate, subsumed and undefined rules. rules are only compared to rules
+    with the same consequent which share a term with them, since a condition can only be bounded
+    by a condition with a common term.'''
+
+    def __init__(self, fuzzy_parameters: Dict[str, FuzzyParameter], output_param: FuzzyParameter) -> None:
+        self.fuzzy_parameters = fuzzy_parameters
+        self.output_param = output_param
+        self.bounds = dict() # (number, number) -> whether the first expression is never above the second
+        # equal expressions get the same number, hashing a number is much cheaper than hashing an expression
+        self.numbers = dict() # type: Dict[Expression, int]
+        self.object_numbers = dict() # type: Dict[int, int]
+
+    def analyze(self, rules: list) -> RulebaseReport:
+        '''Analyze a list of inference.Rule objects.'''
+        findings = []
+        undefined = set()
+        for index, rule in enumerate(rules):
+            reason = self.__get_undefined_reason(rule)
+            if reason:
+                undefined.add(index)
+                findings.append(RuleFinding('undefined', index, rule.line_number, str(rule), reason))
+        # group the defined rules by consequent and index them by their terms
+        groups = dict() # consequent -> term -> indices of the rules which use the term
+        for index, rule in enumerate(rules):
+            if index not in undefined:
+                term_index = groups.setdefault((rule.then_clause_item.parameter_name, rule.then_clause_item.fuzzyset_name), dict())
+                for term in rule.if_clause_items:
+                    term_index.setdefault(term, []).append(index)
+        removed = set()
+        for index, rule in enumerate(rules):
+            if index in undefined:
+                continue
+            term_index = groups[(rule.then_clause_item.parameter_name, rule.then_clause_item.fuzzyset_name)]
+            candidates = sorted({other for term in rule.if_clause_items for other in term_index[term]} - {index})
+            for other in candidates:
+                if other in removed or not self.is_bounded(rule.condition, rules[other].condition):
+                    continue
+                # of two equivalent conditions the first rule is kept
+                if rule.condition == rules[other].condition:
+                    if other < index:
+                        findings.append(RuleFinding('duplicate', index, rule.line_number, str(rule),
+                                                    'same condition and consequent as an earlier rule', other))
+                        removed.add(index)
+                        break
+                elif other < index or not self.is_bounded(rules[other].condition, rule.condition):
+                    findings.append(RuleFinding('subsumed', index, rule.line_number, str(rule),
+                                                'never stronger than a rule with the same consequent', other))
+                    removed.add(index)
+                    break
+        # a rule can be bounded by a rule which was removed later, point to the kept rule which bounds both
+        kept_by = {finding.index: finding.kept_by for finding in findings if finding.kept_by is not None}
+        for finding in findings:
+            while finding.kept_by in removed:
+                finding.kept_by = kept_by[finding.kept_by]
+            if finding.kind == 'subsumed':
+                finding.reason += f': {rules[finding.kept_by].condition}'
+        findings.sort(key=lambda finding: finding.index)
+        return RulebaseReport(len(rules), [index for index in range(len(rules)) if index not in removed], findings)
+
+    def is_bounded(self, expression: Expression, bound: Expression) -> bool:
+        '''Returns True if the value of expression is never above the value of bound, for every
+        membership value of their terms. the check is syntactic, so it can miss bounds but the
+        bounds it finds always hold.'''
+        key = (self.__get_number(expression), self.__get_number(bound))
+        if key not in self.bounds:
+            self.bounds[key] = key[0] == key[1] or self.__is_bounded(expression, bound)
+        return self.bounds[key]
+
+    def __get_number(self, expression: Expression) -> int:
+        number = self.object_numbers.get(id(expression))
+        if number is None:
+            number = self.object_numbers[id(expression)] = self.numbers.setdefault(expression, len(self.numbers))
+        return number
+
+    def __is_bounded(self, expression: Expression, bound: Expression) -> bool:
+        operator = expression.operator if isinstance(expression, OperatorExpression) else None
+        bound_operator = bound.operator if isinstance(bound, OperatorExpression) else None
+        # min(a, ...) <= a, and a <= max(a, ...)
+        if operator == 'AND' and any(self.is_bounded(operand, bound) for operand in expression.operands):
+            return True
+        if bound_operator == 'OR' and any(self.is_bounded(expression, operand) for operand in bound.operands):
+            return True
+        if operator == 'OR' and all(self.is_bounded(operand, bound) for operand in expression.operands):
+            return True
+        if bound_operator == 'AND' and all(self.is_bounded(expression, operand) for operand in bound.operands):
+            return True
+        # 1 - a <= 1 - b when b <= a
+        if operator == 'NOT' and bound_operator == 'NOT':
+            return self.is_bounded(bound.operands[0], expression.operands[0])
+        return False
+
+    def __get_undefined_reason(self, rule) -> str:
+        for term in rule.if_clause_items:
+            param = self.fuzzy_parameters.get(term.parameter_name)
+            if param is None:
+                return f'parameter {term.parameter_name} is not defined'
+            if term.fuzzyset_name not in param.sets:
+                return f'fuzzyset {term.fuzzyset_name} is not defined for parameter {term.parameter_name}'
+        if rule.then_clause_item.fuzzyset_name not in self.output_param.sets:
+            return f'fuzzyset {rule.then_clause_item.fuzzyset_name} is not defined for the output'
+        return None
+
+def optimize_rules(rules: list, fuzzy_parameters: Dict[str, FuzzyParameter], output_param: FuzzyParameter) -> Tuple[list, RulebaseReport]:
+    '''Returns the rules without the duplicate and subsumed ones, in their order, and the report of the analysis.'''
+    report = RulebaseAnalyzer(fuzzy_parameters, output_param).analyze(rules)
+    return [rules[index] for index in report.kept], report
+
+def format_rule(rule, label: str) -> str:
+    '''Returns a rule in rules.fcl format.'''
+    return f'RULE {label}: IF {rule.condition} THEN {rule.then_clause_item.parameter_name} IS {rule.then_clause_item.fuzzyset_name};'
+
+def main(argv: List[str] = None) -> None:
+    from inference import Rule
+    parser = argparse.ArgumentParser(description='Find duplicate, subsumed and undefined rules of a rules file.')
+    parser.add_argument('rules', nargs='?', default='rules.fcl', help='rules file (default: rules.fcl)')
+    parser.add_argument('--output', help='write the optimized rules to this file')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+    with open(args.rules) as f:
+        rules = [Rule(condition, then_clause, line_number) for line_number, condition, then_clause in RuleParser.parse_rules(f)]
+    fuzzy_parameters = {param.name_in_rules: param for param in init_fuzzy_parameters()}
+    optimized, report = optimize_rules(rules, fuzzy_parameters, init_output_fuzzy_sets())
+    if args.json:
+        print(json.dumps(asdict(report), indent=2))
+    else:
+        for finding in report.findings:
+            kept_by = f' (kept line {rules[finding.kept_by].line_number})' if finding.kept_by is not None else ''
+            print(f'line {finding.line_number}: {finding.kind}: {finding.rule}\n    {finding.reason}{kept_by}')
+        print(f'{len(report.kept)} of {report.rule_count} rules kept, {len(report.removed)} removed, '
+              f'{len(report.undefined)} with undefined references')
+    if args.output:
+        with open(args.output, 'w') as f:
+            # rules keep their numbers, so metrics and reports of both files match
+            for index in report.kept:
+                f.write(format_rule(rules[index], str(index + 1)) + '\n')
+    if report.undefined:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
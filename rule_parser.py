@@ -1,39 +1,181 @@
-from typing import List, Tuple
+import re
+from dataclasses import dataclass
+from typing import Iterable, List, Tuple, Union
+
+class RuleSyntaxError(ValueError):
+    '''An error in the text of a rule, with the line and the column where it was found.'''
+
+    def __init__(self, message: str, line_number: int = None, column: int = None) -> None:
+        self.message = message
+        self.line_number = line_number
+        self.column = column
+        location = ', '.join(part for part in (f'line {line_number}' if line_number is not None else None,
+                                               f'column {column}' if column is not None else None) if part)
+        super().__init__(f'{location}: {message}' if location else message)
+
+@dataclass(frozen=True)
+class TermExpression:
+    '''A term of a rule condition like (parameter_name IS fuzzyset_name).'''
+    parameter_name: str
+    fuzzyset_name: str
+
+    def __str__(self) -> str:
+        return f'{self.parameter_name} IS {self.fuzzyset_name}'
+
+@dataclass(frozen=True)
+class OperatorExpression:
+    '''An operator of a rule condition applied to its operands, NOT has one operand and AND, OR
+    have two or more. equal expressions are equal objects, so they can be shared between rules.'''
+    operator: str
+    operands: Tuple[Union[TermExpression, 'OperatorExpression'], ...]
+
+    def __str__(self) -> str:
+        if self.operator == 'NOT':
+            return f'NOT ({self.operands[0]})'
+        return f' {self.operator} '.join(f'({operand})' for operand in self.operands)
+
+Expression = Union[TermExpression, OperatorExpression]
 
 class RuleParser:
+    '''A recursive descent parser of rules in rules.fcl format:
+
+        RULE 1: IF (age IS old) AND NOT ((sex IS male) OR (chest_pain IS typical_anginal)) THEN health IS sick_2;
+
+    the "RULE n:" label and the final ";" are optional. NOT binds tighter than AND, and AND binds
+    tighter than OR. a term can also be written as "parameter IS NOT fuzzyset". conditions are
+    normalized, nested AND (OR) are flattened and the operands of AND and OR are sorted and
+    deduplicated, so equal conditions get equal expressions no matter how they were written.'''
 
-    operators = ['AND', 'OR']
+    keywords = {'RULE', 'IF', 'THEN', 'IS', 'AND', 'OR', 'NOT'}
+    token_pattern = re.compile(r'\s*(?:(?P<word>[A-Za-z_][A-Za-z0-9_]*|\d+)|(?P<symbol>[();:])|(?P<other>\S))')
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, rule: str, line_number: int = None) -> None:
+        self.rule = rule
+        self.line_number = line_number
+        self.tokens = self.__tokenize()
+        self.position = 0
+
+    @classmethod
+    def parse_rule(self, rule: str, line_number: int = None) -> Tuple[Expression, Tuple[str, str]]:
+        '''Given a rule in rules.fcl format, returns the condition and the then clause as a tuple.
+        output format: tuple(condition: Expression, then_clause: tuple(parameter_name, fuzzyset_name))
+        raises RuleSyntaxError if the rule is malformed.'''
+        return RuleParser(rule, line_number).__parse()
 
     @classmethod
-    def parse_rule(self, rule: str) -> Tuple[List, str]:
-        '''Given a rule in rules.fcl format, returns the if and then clauses as a tuple.
-        output format: tuple(if_clause: list, then_clause: str)
-        '''
-        # split then clause
-        splitted_rule = rule.split('THEN')
-        then_clause = splitted_rule[1][:-1].split('IS')
-        then_clause = (then_clause[0].strip(), then_clause[1].strip())
-        # split if clause
-        if_clause = splitted_rule[0].split('IF')[1].replace('(', '( ').replace(')', ' )').strip()
-        if_clause = if_clause.split(' ')
-        # loop over if statement to split words and operators
-        if_clause_list, current_pair = [], []
-        for word in if_clause:
-            # do nothing if the word is paranthesis
-            if word in ['(', ')']:
+    def parse_rules(self, lines: Iterable[str]) -> List[Tuple[int, Expression, Tuple[str, str]]]:
+        '''Parse the rules of the lines of a rules file, empty lines and lines starting with # or //
+        are skipped. returns (line number, condition, then clause) of every rule.'''
+        rules = []
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line or line.startswith('#') or line.startswith('//'):
                 continue
-            # if the word is an operator, add the current pair to the list and start a new pair and add the operator to list.
-            if word in self.operators:
-                if_clause_list.append((current_pair[0], current_pair[1]))
-                current_pair = []
-                if_clause_list.append(word)
-            # if the word is not an operator, add it to the current pair.
-            elif word != 'IS':
-                current_pair.append(word.strip())
-
-        if len(current_pair) != 0:
-            if_clause_list.append((current_pair[0], current_pair[1]))
-        return if_clause_list, then_clause
\ No newline at end of file
+            condition, then_clause = self.parse_rule(line, line_number)
+            rules.append((line_number, condition, then_clause))
+        return rules
+
+    def __tokenize(self) -> List[Tuple[str, int]]:
+        '''Returns the words and symbols of the rule with their columns.'''
+        tokens = []
+        position = 0
+        text = self.rule.rstrip()
+        while position < len(text):
+            match = self.token_pattern.match(text, position)
+            if match.group('other'):
+                self.__error(f'unexpected character {match.group("other")!r}', match.start('other') + 1)
+            name = 'word' if match.group('word') else 'symbol'
+            tokens.append((match.group(name), match.start(name) + 1))
+            position = match.end()
+        return tokens
+
+    def __error(self, message: str, column: int = None) -> None:
+        if column is None:
+            column = self.tokens[self.position][1] if self.position < len(self.tokens) else len(self.rule.rstrip()) + 1
+        raise RuleSyntaxError(message, self.line_number, column)
+
+    def __peek(self) -> str:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def __expect(self, expected: str) -> None:
+        token = self.__peek()
+        if token != expected:
+            self.__error(f'expected {expected!r} but found {token!r}' if token else f'expected {expected!r} at the end of the rule')
+        self.position += 1
+
+    def __name(self, what: str) -> str:
+        token = self.__peek()
+        if token is None or token in self.keywords or not (token[0].isalpha() or token[0] == '_'):
+            self.__error(f'expected {what} but found {token!r}' if token else f'expected {what} at the end of the rule')
+        self.position += 1
+        return token
+
+    def __parse(self) -> Tuple[Expression, Tuple[str, str]]:
+        if self.__peek() == 'RULE':
+            self.position += 1
+            if self.__peek() is None or self.__peek() in self.keywords or self.__peek() in ('(', ')', ';', ':'):
+                self.__error('expected the label of the rule after RULE')
+            self.position += 1
+            self.__expect(':')
+        self.__expect('IF')
+        condition = self.__parse_or()
+        self.__expect('THEN')
+        parameter_name = self.__name('a parameter name')
+        self.__expect('IS')
+        then_clause = (parameter_name, self.__name('a fuzzyset name'))
+        if self.__peek() == ';':
+            self.position += 1
+        if self.__peek() is not None:
+            self.__error(f'unexpected {self.__peek()!r} after the then clause')
+        return condition, then_clause
+
+    def __parse_or(self) -> Expression:
+        operands = [self.__parse_and()]
+        while self.__peek() == 'OR':
+            self.position += 1
+            operands.append(self.__parse_and())
+        return self.__combine('OR', operands)
+
+    def __parse_and(self) -> Expression:
+        operands = [self.__parse_not()]
+        while self.__peek() == 'AND':
+            self.position += 1
+            operands.append(self.__parse_not())
+        return self.__combine('AND', operands)
+
+    def __parse_not(self) -> Expression:
+        if self.__peek() == 'NOT':
+            self.position += 1
+            return self.__negate(self.__parse_not())
+        if self.__peek() == '(':
+            self.position += 1
+            expression = self.__parse_or()
+            self.__expect(')')
+            return expression
+        parameter_name = self.__name('a parameter name or "("')
+        self.__expect('IS')
+        negated = self.__peek() == 'NOT'
+        if negated:
+            self.position += 1
+        term = TermExpression(parameter_name, self.__name('a fuzzyset name'))
+        return self.__negate(term) if negated else term
+
+    @staticmethod
+    def __negate(expression: Expression) -> Expression:
+        # NOT NOT x is x
+        if isinstance(expression, OperatorExpression) and expression.operator == 'NOT':
+            return expression.operands[0]
+        return OperatorExpression('NOT', (expression,))
+
+    @staticmethod
+    def __combine(operator: str, operands: List[Expression]) -> Expression:
+        '''Returns the normalized expression of an AND or OR of operands.'''
+        flat = set()
+        for operand in operands:
+            if isinstance(operand, OperatorExpression) and operand.operator == operator:
+                flat.update(operand.operands)
+            else:
+                flat.add(operand)
+        if len(flat) == 1:
+            return flat.pop()
+        return OperatorExpression(operator, tuple(sorted(flat, key=str)))
@@ -0,0 +1,175 @@
+'''A pre-forking server for the Flask app.
+
+the parent process builds the fuzzy system once, opens the listening socket and forks the
+workers, so every worker shares the parent's read-only model through copy-on-write pages.
+the workers save their metrics to files in one directory, so /metrics reports the totals of
+every worker whichever worker answers the scrape. the parent adds the files of the workers
+which exited to one file, so reloads do not add files.
+
+    python3 serve.py --workers 4 --port 8448
+
+signals of the parent process:
+    SIGHUP           rebuild the model from rules.fcl and replace the workers one by one
+    SIGTERM, SIGINT  let the workers finish their requests and exit
+'''
+import argparse
+import gc
+import glob
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+from typing import List
+from werkzeug.serving import make_server
+from metrics import metrics, retire_process
+
+class PreforkServer:
+    '''A class to run the workers of a WSGI app in forked processes which share one listening socket.'''
+
+    def __init__(self, app, provide_result, host: str, port: int, workers: int, metrics_dir: str = None) -> None:
+        self.app = app
+        self.provide_result = provide_result
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.metrics_dir = metrics_dir or os.path.join(tempfile.gettempdir(), f'fuzzy-metrics-{port}')
+        self.workers = dict() # pid -> generation of the model
+        self.generation = 0
+        self.socket = None
+        self.reload_requested = False
+        self.stopping = False
+
+    def run(self) -> None:
+        '''Start the workers and supervise them until the server is stopped.'''
+        self.socket = socket.create_server((self.host, self.port), backlog=1024)
+        self.socket.set_inheritable(True)
+        signal.signal(signal.SIGHUP, self.__request_reload)
+        signal.signal(signal.SIGTERM, self.__request_stop)
+        signal.signal(signal.SIGINT, self.__request_stop)
+        # the counters start from 0 with every server, the files of an earlier one are removed
+        for file_name in glob.glob(os.path.join(self.metrics_dir, '*.json')):
+            os.remove(file_name)
+        self.__freeze_model()
+        for _ in range(self.worker_count):
+            self.__spawn_worker()
+        print(f'Serving on http://{self.host}:{self.port} with {self.worker_count} workers (pid {os.getpid()})', flush=True)
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.__reap_workers(respawn=True)
+            time.sleep(0.2)
+        self.__stop_workers(list(self.workers))
+        self.socket.close()
+
+    def reload(self) -> None:
+        '''Rebuild the model and replace every worker without closing the listening socket.'''
+        try:
+            self.provide_result.reload()
+        except Exception as e:
+            # keep serving the old model if the new rules can not be loaded
+            print(f'Reload failed, keeping the current model: {e}', flush=True)
+            return
+        self.generation += 1
+        self.__freeze_model()
+        for pid in [pid for pid, generation in self.workers.items() if generation < self.generation]:
+            # start the new worker before the old one stops, so there is always a worker accepting
+            self.__spawn_worker()
+            self.__stop_workers([pid])
+        print(f'Reloaded the model, generation {self.generation}', flush=True)
+
+    def __freeze_model(self) -> None:
+        # move the model out of the garbage collector's reach, otherwise collections in the
+        # workers write to the shared pages and every worker ends up with its own copy
+        gc.collect()
+        gc.freeze()
+
+    def __spawn_worker(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.__run_worker()
+            finally:
+                os._exit(0)
+        self.workers[pid] = self.generation
+
+    def __run_worker(self) -> None:
+        for signum in (signal.SIGHUP, signal.SIGINT):
+            signal.signal(signum, signal.SIG_IGN)
+        metrics.share(self.metrics_dir)
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+        # wait for the running requests when the server is closed
+        server.daemon_threads = False
+        server.block_on_close = True
+        # shutdown blocks until serve_forever returns, so it can not run in the signal handler's thread
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        server.serve_forever()
+        server.server_close()
+        # the last requests of the worker are counted after it exits
+        metrics.flush()
+
+    def __stop_workers(self, pids: List[int], timeout: float = 30) -> None:
+        '''Ask the workers to finish their requests and wait for them, kill them after timeout seconds.'''
+        for pid in pids:
+            self.__kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                    remaining.discard(pid)
+                    self.__remove_worker(pid)
+            time.sleep(0.05)
+        for pid in remaining:
+            self.__kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.__remove_worker(pid)
+
+    def __reap_workers(self, respawn: bool) -> None:
+        '''Collect the workers which exited and replace them.'''
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.__remove_worker(pid) and respawn and not self.stopping:
+                print(f'Worker {pid} exited, starting a new one', flush=True)
+                self.__spawn_worker()
+
+    def __remove_worker(self, pid: int) -> bool:
+        '''Forget a worker which exited and keep its metrics, returns False if pid was not a worker.'''
+        if self.workers.pop(pid, None) is None:
+            return False
+        retire_process(self.metrics_dir, pid)
+        return True
+
+    @staticmethod
+    def __kill(pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def __request_reload(self, signum, frame) -> None:
+        self.reload_requested = True
+
+    def __request_stop(self, signum, frame) -> None:
+        self.stopping = True
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description='Serve the fuzzy system with pre-forked worker processes.')
+    parser.add_argument('--host', default='127.0.0.1', help='host to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8448, help='port to listen on (default: 8448)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: cpu count)')
+    parser.add_argument('--metrics-dir', help='directory of the metrics files of the workers (default: fuzzy-metrics-<port> in the temp directory)')
+    args = parser.parse_args(argv)
+    # importing the app builds the fuzzy system in the parent process
+    from app import app, provide_result
+    PreforkServer(app, provide_result, args.host, args.port, args.workers, args.metrics_dir).run()
+
+if __name__ == '__main__':
+    main()
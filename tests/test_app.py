@@ -0,0 +1,35 @@
+import pytest
+from metrics import metrics
+
+
+@pytest.fixture(scope='module')
+def app():
+    # importing the app enables the metrics of the process
+    enabled = metrics.enabled
+    import app
+    yield app
+    metrics.enabled = enabled
+
+
+@pytest.mark.parametrize('cached', [True, False])
+@pytest.mark.parametrize('form, error', [
+    ({'age': 'old'}, 'is not a number'),
+    ({}, 'is not in input dict'),
+    ({'age': 1000}, 'is out of range'),
+])
+def test_result_form_with_invalid_input_is_a_bad_request(app, monkeypatch, cached, form, error):
+    if not cached:
+        monkeypatch.setattr(app.provide_result, 'cache', None)
+    fs = app.provide_result.fuzzy_system
+    values = {name: sum(fs.fuzzy_parameters[name].range) / 2 for name in fs.compiled_rules.parameter_names}
+    response = app.app.test_client().post('/result', data={**values, **form} if form else form)
+    assert response.status_code == 400
+    assert error in response.get_data(as_text=True)
+
+
+def test_result_form_renders_the_result(app):
+    fs = app.provide_result.fuzzy_system
+    values = {name: sum(fs.fuzzy_parameters[name].range) / 2 for name in fs.compiled_rules.parameter_names}
+    response = app.app.test_client().post('/result', data=values)
+    assert response.status_code == 200
+    assert 'Result is' in response.get_data(as_text=True)
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from defuzzification import (CenterOfMassDefuz, CentroidDefuz, FuzzySetDefuzData, HeightDefuz, MeanOfMaximumDefuz,
+                             MemoizedDefuz, WeightedAverageDefuz)
+from fuzzification import init_output_fuzzy_sets
+
+STRIDE = 0.001
+
+CUT_VALUES = [
+    [1, 0, 0, 0, 0],
+    [0, 0, 0.6, 0, 0],
+    [0, 0, 0, 0, 1],
+    [0.3, 0.7, 0, 0, 0],
+    [0, 0.5, 0.5, 0.5, 0],
+    [0.2, 0.4, 0.6, 0.8, 1],
+    [1, 1, 1, 1, 1],
+    [0.01, 0, 0, 0.25, 0.75],
+]
+
+
+@pytest.fixture(scope='module')
+def output_param():
+    return init_output_fuzzy_sets()
+
+
+@pytest.fixture(scope='module')
+def fuzzy_sets(output_param):
+    return list(output_param.sets.values())
+
+
+@pytest.fixture(scope='module')
+def random_cut_values(fuzzy_sets):
+    # cut levels of the grid and random ones, so cuts meet at breakpoints and between them
+    cut_values = np.random.default_rng(0).choice([0, 0.25, 0.5, 0.75, 1, np.nan], size=(200, len(fuzzy_sets)))
+    cut_values = np.where(np.isnan(cut_values), np.random.default_rng(1).random(cut_values.shape), cut_values)
+    cut_values[:, 0] = np.maximum(cut_values[:, 0], 0.01)
+    return cut_values
+
+
+@pytest.mark.parametrize('cut_values', CUT_VALUES)
+def test_centroid_matches_center_of_mass(output_param, fuzzy_sets, cut_values):
+    data = [FuzzySetDefuzData(fuzzy_set, cut) for fuzzy_set, cut in zip(fuzzy_sets, cut_values)]
+    sampled = CenterOfMassDefuz(stride=STRIDE, range=output_param.range).defuzzify(data)
+    exact = CentroidDefuz(range=output_param.range).defuzzify(data)
+    assert exact == pytest.approx(sampled, abs=2 * STRIDE)
+
+
+def test_centroid_matches_center_of_mass_batch(output_param, fuzzy_sets, random_cut_values):
+    sampled = CenterOfMassDefuz(stride=STRIDE, range=output_param.range).defuzzify_batch(fuzzy_sets, random_cut_values)
+    exact = CentroidDefuz(range=output_param.range).defuzzify_batch(fuzzy_sets, random_cut_values)
+    np.testing.assert_allclose(exact, sampled, atol=2 * STRIDE)
+
+
+def test_centroid_of_no_active_set_is_nan(output_param, fuzzy_sets):
+    cut_values = np.zeros((1, len(fuzzy_sets)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sampled = CenterOfMassDefuz(stride=STRIDE, range=output_param.range).defuzzify_batch(fuzzy_sets, cut_values)
+    exact = CentroidDefuz(range=output_param.range).defuzzify_batch(fuzzy_sets, cut_values)
+    assert np.isnan(sampled[0]) and np.isnan(exact[0])
+
+
+def test_centroid_of_single_active_set_is_its_centroid(output_param, fuzzy_sets):
+    centroid = CentroidDefuz(range=output_param.range)
+    for k, fuzzy_set in enumerate(fuzzy_sets):
+        cut_values = np.zeros((1, len(fuzzy_sets)))
+        cut_values[0, k] = 1
+        assert centroid.defuzzify_batch(fuzzy_sets, cut_values)[0] == pytest.approx(fuzzy_set.get_moments().centroid)
+
+
+def test_centroid_splits_the_intervals_once_per_list_of_sets(output_param, fuzzy_sets, random_cut_values):
+    centroid = CentroidDefuz(range=output_param.range)
+    first = centroid.defuzzify_batch(fuzzy_sets, random_cut_values)
+    scalar = [centroid.defuzzify([FuzzySetDefuzData(fuzzy_set, cut) for fuzzy_set, cut in zip(fuzzy_sets, row)])
+              for row in random_cut_values]
+    # a list of other sets has its own intervals
+    reversed_sets = fuzzy_sets[::-1]
+    reversed_result = centroid.defuzzify_batch(reversed_sets, random_cut_values[:, ::-1])
+    assert len(centroid.intervals) == 2
+    np.testing.assert_array_equal(centroid.defuzzify_batch(fuzzy_sets, random_cut_values), first)
+    np.testing.assert_array_equal(scalar, first)
+    np.testing.assert_allclose(reversed_result, first)
+
+
+@pytest.mark.parametrize('method', [WeightedAverageDefuz(), HeightDefuz(), MeanOfMaximumDefuz()], ids=lambda method: type(method).__name__)
+def test_approximate_batch_matches_defuzzify(fuzzy_sets, random_cut_values, method):
+    batch = method.defuzzify_batch(fuzzy_sets, random_cut_values)
+    scalar = [method.defuzzify([FuzzySetDefuzData(fuzzy_set, cut) for fuzzy_set, cut in zip(fuzzy_sets, row)])
+              for row in random_cut_values]
+    np.testing.assert_allclose(batch, scalar)
+
+
+def test_memo_batch_remembers_rows(output_param, fuzzy_sets, random_cut_values):
+    memo = MemoizedDefuz(CentroidDefuz(range=output_param.range), max_entries=100)
+    exact = CentroidDefuz(range=output_param.range).defuzzify_batch(fuzzy_sets, random_cut_values)
+    np.testing.assert_array_equal(memo.defuzzify_batch(fuzzy_sets, random_cut_values), exact)
+    assert len(memo.entries) == 100
+    data = [FuzzySetDefuzData(fuzzy_set, cut) for fuzzy_set, cut in zip(fuzzy_sets, random_cut_values[-1])]
+    assert memo.defuzzify(data) == exact[-1]
+    assert memo.hits == 1
+
+
+def test_memo_grid_interpolates_accurate_cells(output_param, fuzzy_sets):
+    memo = MemoizedDefuz(CentroidDefuz(range=output_param.range), grid_step=0.25, max_error=0.01)
+    memo.warm_up(fuzzy_sets)
+    assert 0 < memo.accurate_cells.mean() < 1
+    # the middles of the cells are where the error was checked
+    middles = np.random.default_rng(2).integers(0, 4, size=(200, len(fuzzy_sets))) * 0.25 + 0.125
+    exact = CentroidDefuz(range=output_param.range).defuzzify_batch(fuzzy_sets, middles)
+    np.testing.assert_allclose(memo.defuzzify_batch(fuzzy_sets, middles), exact, atol=0.01)
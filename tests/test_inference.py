@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from benchmark import generate_patients
+from inference import FuzzyIntelligentSystem
+
+
+@pytest.fixture(scope='module')
+def patients():
+    return generate_patients(500, seed=3)
+
+
+def test_batch_matches_scalar_exactly(patients):
+    # separate systems, so the scalar results are not read from the memo filled by the batch
+    scalar_system, batch_system = FuzzyIntelligentSystem(), FuzzyIntelligentSystem()
+    columns = {name: [patient[name] for patient in patients] for name in batch_system.compiled_rules.parameter_names}
+    results, statuses, cut_values = batch_system.calculate_batch_and_cut_values(columns)
+    for patient, result, status, cuts in zip(patients, results, statuses, cut_values):
+        scalar_result, scalar_cut_values = scalar_system.calculate_result_and_cut_values(patient)
+        np.testing.assert_array_equal(result, scalar_result)
+        assert status == scalar_system.get_health_status(scalar_result)
+        assert list(cuts) == [scalar_cut_values[name] for name in batch_system.compiled_rules.consequents]
@@ -0,0 +1,37 @@
+import json
+import os
+from metrics import RETIRED_FILE, Metrics, retire_process
+
+
+def save_process(directory, pid: int, requests: int) -> None:
+    process = Metrics(enabled=True)
+    process.increment('fuzzy_requests_total', requests, route='/api/score')
+    process.observe('fuzzy_request_duration_seconds', 0.002, route='/api/score')
+    with open(os.path.join(directory, f'{pid}-1.json'), 'w') as f:
+        json.dump(process.snapshot(), f)
+
+
+def test_retired_processes_are_added_to_one_file(tmp_path):
+    scraper = Metrics(enabled=True)
+    scraper.share(str(tmp_path), flush_interval=3600)
+    for pid, requests in ((101, 2), (102, 3), (103, 5)):
+        save_process(tmp_path, pid, requests)
+    retire_process(str(tmp_path), 101)
+    retire_process(str(tmp_path), 102)
+    # a process without a file, e.g. a worker which was killed before it shared its metrics
+    retire_process(str(tmp_path), 104)
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.json')) == sorted(
+        ['103-1.json', RETIRED_FILE, os.path.basename(scraper.file_name)])
+    exported = scraper.export()
+    assert 'fuzzy_requests_total{route="/api/score"} 10' in exported
+    assert 'fuzzy_request_duration_seconds_count{route="/api/score"} 3' in exported
+
+
+def test_stage_timer_records_nothing_while_disabled():
+    for enabled in (False, True):
+        process = Metrics(enabled=enabled)
+        timer = process.stage_timer()
+        timer.lap('fuzzification')
+        timer.lap('defuzzification')
+        histograms = process.histograms['fuzzy_stage_duration_seconds']
+        assert sorted(dict(key)['stage'] for key in histograms) == (['defuzzification', 'fuzzification'] if enabled else [])
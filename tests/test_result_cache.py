@@ -0,0 +1,76 @@
+import sqlite3
+import pytest
+from benchmark import generate_patients
+from inference import FuzzyIntelligentSystem
+from result_cache import ResultCache
+
+
+@pytest.fixture(scope='module')
+def fuzzy_system():
+    return FuzzyIntelligentSystem()
+
+
+@pytest.fixture(scope='module')
+def patients():
+    return generate_patients(10, seed=5)
+
+
+def test_hits_return_the_scored_results(fuzzy_system, patients):
+    cache = ResultCache()
+    first = cache.get_results_and_cut_values(fuzzy_system, patients)
+    assert (cache.hits, cache.misses) == (0, len(patients))
+    assert cache.get_results_and_cut_values(fuzzy_system, patients) == first
+    assert cache.hits == len(patients)
+    result, cut_values = fuzzy_system.calculate_result_and_cut_values(patients[0])
+    assert first[0] == (result, fuzzy_system.get_health_status(result), cut_values, None)
+
+
+def test_least_recently_used_entry_is_evicted(fuzzy_system, patients):
+    cache = ResultCache(max_entries=3)
+    cache.get_results(fuzzy_system, patients[:3])
+    # using the first patient again makes the second one the least recently used
+    cache.get_results(fuzzy_system, patients[:1])
+    cache.get_results(fuzzy_system, patients[3:4])
+    assert len(cache.entries) == 3
+    cache.hits = cache.misses = 0
+    cache.get_results(fuzzy_system, [patients[0], patients[2], patients[3]])
+    assert (cache.hits, cache.misses) == (3, 0)
+    cache.get_results(fuzzy_system, patients[1:2])
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_expire_after_ttl(fuzzy_system, patients, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('result_cache.time.time', lambda: now[0])
+    cache = ResultCache(ttl=60)
+    cache.get_results(fuzzy_system, patients[:1])
+    now[0] += 59
+    cache.get_results(fuzzy_system, patients[:1])
+    assert (cache.hits, cache.misses) == (1, 1)
+    now[0] += 61
+    cache.get_results(fuzzy_system, patients[:1])
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_changed_fingerprint_clears_the_cache(fuzzy_system, patients, tmp_path):
+    db_path = str(tmp_path / 'results.db')
+    cache = ResultCache(db_path=db_path)
+    cache.get_results(fuzzy_system, patients)
+    # a reload with another rulebase, its results must not come from the old one
+    with open('rules.fcl') as f:
+        rules = f.readlines()
+    rules_file = tmp_path / 'rules.fcl'
+    rules_file.write_text(''.join(rules[1:]))
+    reloaded = FuzzyIntelligentSystem(str(rules_file))
+    assert reloaded.fingerprint != fuzzy_system.fingerprint
+    cache.hits = cache.misses = 0
+    results = cache.get_results(reloaded, patients)
+    assert (cache.hits, cache.misses) == (0, len(patients))
+    assert results == reloaded.calculate_records(patients)
+    assert len(cache.entries) == len(patients)
+    # the entries of the old rulebase are removed from the shared file too
+    other_process = ResultCache(db_path=db_path)
+    other_process.get_results(reloaded, patients)
+    assert other_process.hits == len(patients)
+    with sqlite3.connect(db_path) as connection:
+        assert connection.execute('SELECT COUNT(*) FROM results').fetchone()[0] == len(patients)
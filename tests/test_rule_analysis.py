@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from benchmark import generate_patients
+from fuzzification import init_fuzzy_parameters, init_output_fuzzy_sets
+from inference import FuzzyIntelligentSystem, Rule
+from rule_analysis import optimize_rules
+from rule_parser import RuleParser
+
+RULES = [
+    'IF (age IS old) THEN health IS sick_2',
+    'IF (age IS old) AND (sex IS male) THEN health IS sick_2',
+    'IF (sex IS male) AND (age IS old) THEN health IS sick_2',
+    'IF (age IS old) AND (sex IS male) THEN health IS sick_3',
+    'IF (age IS ancient) THEN health IS sick_1',
+    'IF (sex IS male) OR (cholesterol IS high) THEN health IS sick_3',
+    'IF NOT (NOT (cholesterol IS high)) THEN health IS sick_4',
+    'IF (cholesterol IS high) THEN health IS sick_4',
+]
+
+
+@pytest.fixture(scope='module')
+def report():
+    rules = [Rule(*RuleParser.parse_rule(rule), line_number) for line_number, rule in enumerate(RULES, start=1)]
+    fuzzy_parameters = {param.name_in_rules: param for param in init_fuzzy_parameters()}
+    return optimize_rules(rules, fuzzy_parameters, init_output_fuzzy_sets())[1]
+
+
+def test_removed_rules(report):
+    findings = [(finding.kind, finding.line_number, finding.kept_by) for finding in report.findings]
+    assert findings == [
+        ('subsumed', 2, 0),
+        # the same condition as the rule before it once the operands are sorted, that rule is removed so the first rule bounds it
+        ('subsumed', 3, 0),
+        ('subsumed', 4, 5),
+        ('undefined', 5, None),
+        ('duplicate', 8, 6),
+    ]
+    assert report.kept == [0, 4, 5, 6]
+
+
+def test_optimized_rules_give_identical_outputs():
+    patients = generate_patients(5000, seed=4)
+    systems = [FuzzyIntelligentSystem(optimize_rules=optimize) for optimize in (False, True)]
+    assert len(systems[1].fuzzy_rules) < len(systems[0].fuzzy_rules)
+    outputs = []
+    for system in systems:
+        columns = {name: [patient[name] for patient in patients] for name in system.compiled_rules.parameter_names}
+        results, _, cut_values = system.calculate_batch_and_cut_values(columns)
+        outputs.append((results, {name: cut_values[:, i] for i, name in enumerate(system.compiled_rules.consequents)}))
+    (results, cut_values), (optimized_results, optimized_cut_values) = outputs
+    assert cut_values.keys() == optimized_cut_values.keys()
+    for name in cut_values:
+        np.testing.assert_array_equal(optimized_cut_values[name], cut_values[name])
+    np.testing.assert_array_equal(optimized_results, results)
@@ -0,0 +1,67 @@
+import pytest
+from rule_parser import OperatorExpression, RuleParser, RuleSyntaxError, TermExpression
+
+A, B, C, D = (TermExpression(name, 'x') for name in 'abcd')
+
+
+def parse_condition(condition: str):
+    return RuleParser.parse_rule(f'IF {condition} THEN health IS sick_1')[0]
+
+
+def test_parse_rule_with_label():
+    condition, then_clause = RuleParser.parse_rule('RULE 1: IF (age IS old) AND (sex IS male) THEN health IS sick_2;')
+    assert condition == OperatorExpression('AND', (TermExpression('age', 'old'), TermExpression('sex', 'male')))
+    assert then_clause == ('health', 'sick_2')
+
+
+def test_and_binds_tighter_than_or():
+    assert parse_condition('a IS x OR b IS x AND c IS x') == OperatorExpression('OR', (OperatorExpression('AND', (B, C)), A))
+    assert parse_condition('a IS x AND b IS x OR c IS x') == OperatorExpression('OR', (OperatorExpression('AND', (A, B)), C))
+
+
+def test_not_binds_tighter_than_and():
+    assert parse_condition('NOT a IS x AND b IS x') == OperatorExpression('AND', (OperatorExpression('NOT', (A,)), B))
+
+
+def test_parentheses_group():
+    assert parse_condition('(a IS x OR b IS x) AND c IS x') == OperatorExpression('AND', (OperatorExpression('OR', (A, B)), C))
+    assert parse_condition('NOT (a IS x OR b IS x)') == OperatorExpression('NOT', (OperatorExpression('OR', (A, B)),))
+    assert parse_condition('((a IS x))') == A
+
+
+def test_not_not_is_eliminated():
+    assert parse_condition('NOT NOT a IS x') == A
+    assert parse_condition('NOT (a IS NOT x)') == A
+    assert parse_condition('NOT NOT NOT a IS x') == OperatorExpression('NOT', (A,))
+
+
+def test_operands_are_flattened_sorted_and_deduplicated():
+    assert parse_condition('c IS x AND (b IS x AND a IS x) AND c IS x') == OperatorExpression('AND', (A, B, C))
+    assert parse_condition('b IS x OR a IS x') == parse_condition('a IS x OR b IS x')
+    assert parse_condition('a IS x AND a IS x') == A
+    # operands are sorted by their text and different operators are not flattened into each other
+    assert parse_condition('d IS x OR (a IS x OR b IS x AND c IS x)') == OperatorExpression(
+        'OR', (OperatorExpression('AND', (B, C)), A, D))
+
+
+@pytest.mark.parametrize('rule, column, message', [
+    ('IF (age IS old THEN health IS sick_1', 16, "expected ')' but found 'THEN'"),
+    ('IF age IS old AND THEN health IS sick_1', 19, "expected a parameter name or \"(\" but found 'THEN'"),
+    ('IF age old THEN health IS sick_1', 8, "expected 'IS' but found 'old'"),
+    ('IF age IS old THEN health IS', 29, 'expected a fuzzyset name at the end of the rule'),
+    ('IF age IS old THEN health IS sick_1; x', 38, "unexpected 'x' after the then clause"),
+    ('IF age IS old & sex IS male THEN health IS sick_1', 15, "unexpected character '&'"),
+    ('RULE: IF age IS old THEN health IS sick_1', 5, 'expected the label of the rule after RULE'),
+])
+def test_syntax_error_location(rule, column, message):
+    with pytest.raises(RuleSyntaxError) as error:
+        RuleParser.parse_rule(rule, line_number=7)
+    assert (error.value.line_number, error.value.column, error.value.message) == (7, column, message)
+    assert str(error.value) == f'line 7, column {column}: {message}'
+
+
+def test_parse_rules_reports_the_line_number():
+    lines = ['# comment', '', 'IF age IS old THEN health IS sick_1', 'IF age IS THEN health IS sick_1']
+    with pytest.raises(RuleSyntaxError) as error:
+        RuleParser.parse_rules(lines)
+    assert (error.value.line_number, error.value.column) == (4, 11)